@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""Measures creating a LayeredConfig object from a long command line,
+both with a bootstrapped parser and with a provided ArgumentParser
+that only knows about some of the options.
+
+Usage: python benchmarks/commandline_parse.py [args] [sections]
+
+"""
+from __future__ import print_function
+import argparse
+import os
+import sys
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from layeredconfig import LayeredConfig, Defaults, Commandline
+
+
+def commandline(args, sections):
+    result = []
+    for i in range(args):
+        if i % 10 == 0:
+            result.append("--flag%04d" % i)
+        elif i % 3 == 0:
+            result.append("--section%02d-value%04d=%d" % (i % sections, i, i))
+        else:
+            result.append("--value%04d=%d" % (i, i))
+    return result
+
+
+def main(args=2000, sections=20):
+    cmdline = commandline(args, sections)
+    defaults = Defaults({"value0001": 0, "flag0000": False})
+
+    start = timer()
+    cfg = LayeredConfig(defaults, Commandline(cmdline))
+    print("bootstrapped: %.3f s" % (timer() - start))
+
+    parser = argparse.ArgumentParser()
+    for i in range(0, args, 7):
+        parser.add_argument("--value%04d" % i, type=int)
+    start = timer()
+    cfg = LayeredConfig(defaults, Commandline(cmdline, parser=parser))
+    print("provided parser: %.3f s" % (timer() - start))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Measures loading a large PList file and reading values from it
+repeatedly through a LayeredConfig object.
+
+Usage: python benchmarks/plist_reads.py [sections] [reads]
+
+"""
+from __future__ import print_function
+import os
+import plistlib
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from layeredconfig import LayeredConfig, PListFile
+
+
+def main(sections=2000, reads=20):
+    data = {}
+    for i in range(sections):
+        data["section%d" % i] = {"name": "section %d" % i,
+                                 "enabled": bool(i % 2),
+                                 "count": i,
+                                 "tags": ["foo", "bar", "baz"]}
+    fd, filename = tempfile.mkstemp(suffix=".plist")
+    os.close(fd)
+    try:
+        with open(filename, "wb") as fp:
+            if sys.version_info >= (3, 4):
+                plistlib.dump(data, fp)
+            else:
+                plistlib.writePlist(data, fp)
+
+        start = timer()
+        cfg = LayeredConfig(PListFile(filename))
+        print("load: %.3f s" % (timer() - start))
+
+        start = timer()
+        for _ in range(reads):
+            for i in range(sections):
+                section = getattr(cfg, "section%d" % i)
+                section.name
+                section.tags
+                list(section)
+        print("%d reads: %.3f s" % (reads * sections * 3, timer() - start))
+    finally:
+        os.unlink(filename)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
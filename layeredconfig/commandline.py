@@ -1,5 +1,7 @@
 import sys
 import argparse
+import bisect
+import re
 
 from six import text_type as str
 
@@ -7,6 +9,62 @@ from . import ConfigSource
 
 UNIT_SEP = chr(31)
 
+
+def _longoptions(commandline):
+    # returns the names of all long options in commandline, in order
+    # and without duplicates, eg "mymodule-force" for
+    # "--mymodule-force=True".
+    seen = set()
+    for arg in commandline:
+        if arg.startswith("--") and arg != "--":
+            argname = arg[2:].split("=", 1)[0]
+            if argname not in seen:
+                seen.add(argname)
+                yield argname
+
+
+# argparse treats arguments like these as values, not options
+_negativenumber = re.compile(r'^-\d+$|^-\d*\.\d+$')
+
+
+def _parselongoptions(commandline, sectionsep):
+    # Does the same thing as parsing commandline with a bootstrapping
+    # argument parser, that has an argument (with action='append',
+    # nargs='?' and const=True) for each long option in it, only
+    # much faster. Returns the dict of values and the list of
+    # remaining arguments, or None if the command line needs
+    # argparse (for showing help, or handling "--").
+    values = {}
+    rest = []
+    expecting = None  # the values of a valueless option
+    for arg in commandline:
+        if (arg.startswith("-h") or
+                arg.split("=", 1)[0] in ("--", "--help")):
+            return None
+        if arg.startswith("--"):
+            argname, sep, value = arg[2:].partition("=")
+            dest = values.setdefault(argname.replace(sectionsep, UNIT_SEP),
+                                     [])
+            if sep:
+                dest.append(value)
+                expecting = None
+            else:
+                # might be replaced with the next argument
+                dest.append(True)
+                expecting = dest
+        elif (arg.startswith("-") and len(arg) > 1 and " " not in arg and
+              not _negativenumber.match(arg)):
+            # an unknown short option
+            rest.append(arg)
+            expecting = None
+        elif expecting is not None:
+            expecting[-1] = arg
+            expecting = None
+        else:
+            rest.append(arg)
+    return values, rest
+
+
 class Commandline(ConfigSource):
 
     rest = []
@@ -58,33 +116,27 @@ class Commandline(ConfigSource):
         else:
             self.commandline = commandline
         self.autoargs = kwargs.get('autoargs', {})
+        parsed = None
         if parser is None:
-            if kwargs.get('parent'):
-                # we're a subsection object, we don't need a parser. 
+            subsection = kwargs.get('parent') or kwargs.get('source')
+            if not (subsection or self.autoargs):
+                # a command line with nothing but long options and
+                # their values doesn't need argparse.
+                parsed = _parselongoptions(self.commandline, self.sectionsep)
+            if subsection or parsed:
+                # we're a subsection object, or the command line is
+                # already parsed, we don't need a parser. 
                 self.parser = None
             else:
                 # create a "bootstrapping" argument parser
                 self.parser = argparse.ArgumentParser()
-                for arg in self.commandline:
-                    if arg.startswith("--"):
-                        argname = arg.split("=")[0][2:]
-                        if argname not in self.autoargs:
-                            # at this point we don't know anything about
-                            # this argument other than that it exists and
-                            # our bootstrapping argument parser should
-                            # handle it.
-                            # * use nargs='?' to allow arguments with or without
-                            #   values.
-                            # * use const=True to treat valueless arguments as
-                            #   set bool flags
-                            # * use action='append' to allow a single argument
-                            #   (eg --extra) to be used multiple times with values)
-                            self.parser.add_argument("--%s" % argname,
-                                                     action='append',
-                                                     nargs='?',
-                                                     dest=argname.replace(self.sectionsep, UNIT_SEP),
-                                                     const=True)
-                            self.autoargs[argname] = True
+                for argname in _longoptions(self.commandline):
+                    if argname not in self.autoargs:
+                        # at this point we don't know anything about
+                        # this argument other than that it exists and
+                        # our bootstrapping argument parser should
+                        # handle it.
+                        self._addoption(argname)
             self._provided_parser = False
         else:
             self.parser = parser
@@ -97,29 +149,79 @@ class Commandline(ConfigSource):
         else:
             if kwargs.get('source'):
                 self.source = kwargs['source']
+            elif parsed:
+                values, self.rest = parsed
+                self.source = argparse.Namespace(**values)
+                for dest in values:
+                    self.autoargs[dest.replace(UNIT_SEP, self.sectionsep)] = True
             else:
+                if self._provided_parser:
+                    # reconfigure our provided parser and add
+                    # arguments for every long option that it doesn't
+                    # know about, so that a single pass of parsing
+                    # handles them all.
+                    known = self._knownoptions()
+                    for argname in _longoptions(self.commandline):
+                        if (argname not in self.autoargs and
+                                not known(argname)):
+                            self._addoption(argname)
                 self.source, self.rest = self.parser.parse_known_args(self.commandline)
-        if self._provided_parser and self.rest:
-            # reconfigure our provided parser and try to add arguments
-            # for every unprocessed long option.
-            for arg in self.rest:
-                if arg.startswith("--"):
-                    argname = arg.split("=")[0][2:]
-                    if (argname not in self.autoargs and
-                        argname not in self.source):
-                        self.parser.add_argument("--%s" % argname,
-                                                 action='append',
-                                                 nargs='?',
-                                                 dest=argname.replace(self.sectionsep, UNIT_SEP),
-                                                 const=True)
-                        self.autoargs[argname] = True
-            # now redo the parsing
-            self.source, self.rest = self.parser.parse_known_args(self.commandline)
+
+    def _addoption(self, argname, **kwargs):
+        # * use nargs='?' to allow arguments with or without
+        #   values.
+        # * use const=True to treat valueless arguments as
+        #   set bool flags
+        # * use action='append' to allow a single argument
+        #   (eg --extra) to be used multiple times with values)
+        self.parser.add_argument("--%s" % argname,
+                                 action='append',
+                                 nargs='?',
+                                 const=True,
+                                 dest=argname.replace(self.sectionsep, UNIT_SEP),
+                                 **kwargs)
+        self.autoargs[argname] = True
+
+    def _argname(self, key):
+        # in a subsection object, the parser (and autoargs) is shared
+        # with the root object, so the option must be qualified with
+        # the section name.
+        if self.sectionkey:
+            return self.sectionsep.join(self.sectionkey.split(UNIT_SEP) + [key])
+        else:
+            return key
+
+    def _knownoptions(self):
+        # returns a function that tells whether the parser already
+        # handles a long option, either because it has been
+        # configured with it (or with an argument stored under the
+        # same name), or because it's an abbreviation of a configured
+        # option.
+        options = set()
+        dests = set()
+        for action in self.parser._actions:
+            options.update(action.option_strings)
+            dests.add(action.dest)
+        abbrev = getattr(self.parser, 'allow_abbrev', True)
+        ordered = sorted(options)
+
+        def known(argname):
+            option = "--" + argname
+            if option in options or argname in dests:
+                return True
+            # any option that option is an abbreviation of sorts
+            # right after it
+            idx = bisect.bisect(ordered, option)
+            return (abbrev and idx < len(ordered) and
+                    ordered[idx].startswith(option))
+        return known
 
     def setup(self, config):
         if not self.parser:
-            # we're in an empty subsection object
+            # we're in an empty subsection object, or parsed the
+            # command line without argparse
             return 
+        added = False
         for key in config:
             # since this will be used to handle -h, we need to fill it
             # with helpy things (default types, default values, help strings)
@@ -132,22 +234,21 @@ class Commandline(ConfigSource):
                 else:
                     kwargs = {}
 
-                if key not in self.source:
-                    self.parser.add_argument('--%s' % key,
-                                             action='append',
-                                             nargs='?',
-                                             const=True,
-                                             dest=key.replace(self.sectionsep, UNIT_SEP),
-                                             **kwargs)
-                    self.autoargs[key] = True
+                argname = self._argname(key)
+                if argname.replace(self.sectionsep, UNIT_SEP) not in self.source:
+                    self._addoption(argname, **kwargs)
+                    added = True
             except argparse.ArgumentError:
                 # the parser already had this argument -- assume it's
                 # fully configured with typing, help, and
                 # everything. But it'd be nice if we could jam a
                 # default value in there somehow
                 pass
-        # process everything and print help if -h is given
-        self.source, self.rest = self.parser.parse_known_args(self.commandline)
+        if added:
+            # process everything and print help if -h is given. If no
+            # arguments were added, the result would be the same as
+            # when the command line was first parsed.
+            self.source, self.rest = self.parser.parse_known_args(self.commandline)
 
     def keys(self):
         if self.source:
@@ -231,7 +332,7 @@ class Commandline(ConfigSource):
             # a provided parser (not a bootstrapped parser) should be
             # able to convert input to typed data -- but only for
             # those arguments that were configured
-            return self.has(key) and key not in self.autoargs
+            return self.has(key) and self._argname(key) not in self.autoargs
         else:
             # a boostrapped parser will support typing for bool
             # (valueless args) and lists (multiple args)
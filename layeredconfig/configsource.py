@@ -1,7 +1,12 @@
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
 from datetime import date, datetime
 import ast
+import codecs
 import inspect
+import os
+import shutil
+import uuid
 
 from . import LayeredConfig
 
@@ -21,6 +26,15 @@ class ConfigSource(object):
     """For writable sources, whether any parameter value in this source
     has been changed so that a call to :py:meth:`save` might be needed."""
 
+    changed = None
+    """For writable root sources, the set of parameters that have been
+    changed since the last call to :py:meth:`save`, or None if nothing
+    has changed. Each parameter is represented by a tuple of the names
+    of the (possibly nested) subsections leading to it, followed by
+    the parameter name, eg. ``('mymodule', 'force')``. Sources that
+    can update their backend piecemeal may use this in :py:meth:`save`
+    to only write what's changed."""
+
     parent = None
     """The parent of this source, if this represents a nested
     configuration source, or None"""
@@ -164,7 +178,9 @@ class ConfigSource(object):
         a loaded configuration file with all changed data, or similar.
 
         This method will only ever be called if :py:data:`writable` is
-        True, and only if :py:data:`dirty` has been set to True.
+        True, and only if :py:data:`dirty` has been set to True. After
+        it returns, :py:data:`dirty` is reset to False and
+        :py:data:`changed` to None.
 
         If your source is read-only, you don't have to implement this method.
         """
@@ -232,3 +248,34 @@ class ConfigSource(object):
                 return ", ".join(value)
         else:
             return str(value)
+
+    # Internal helper for file-based sources. Yields a file object for
+    # a temporary file next to filename, which replaces filename once
+    # everything has been written. Readers of filename therefore never
+    # see a partially written file. If filename is a symlink, the
+    # file it points to is replaced, not the link.
+    @contextmanager
+    def _atomicfile(self, filename, mode="w", encoding=None):
+        filename = os.path.realpath(filename)
+        tmpfilename = "%s.%s.tmp" % (filename, uuid.uuid4().hex[:8])
+        if encoding:
+            fp = codecs.open(tmpfilename, mode, encoding=encoding)
+        else:
+            fp = open(tmpfilename, mode)
+        try:
+            with fp:
+                yield fp
+            if os.path.exists(filename):
+                shutil.copymode(filename, tmpfilename)
+            if hasattr(os, 'replace'):
+                os.replace(tmpfilename, filename)
+            else:  # pragma: no cover
+                # python 2, where os.rename can't replace existing
+                # files on windows
+                if os.name == 'nt' and os.path.exists(filename):
+                    os.remove(filename)
+                os.rename(tmpfilename, filename)
+        finally:
+            # only exists if something went wrong
+            if os.path.exists(tmpfilename):
+                os.remove(tmpfilename)
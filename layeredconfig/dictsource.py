@@ -1,4 +1,9 @@
 # this should possibly be a abstract class as well
+import os
+
+import six
+from six import binary_type as bytes
+
 from . import ConfigSource
 
 
@@ -27,8 +32,11 @@ class DictSource(ConfigSource):
                 yield k
 
     def subsection(self, key):
+        value = self.source[key]
+        if isinstance(value, _Pending):
+            value = self.source[key] = value.load()
         # Make an object of the correct type
-        return self.__class__(defaults=self.source[key],
+        return self.__class__(defaults=value,
                               parent=self,
                               identifier=self.identifier)
 
@@ -45,3 +53,109 @@ class DictSource(ConfigSource):
 
     def set(self, key, value):
         self.source[key] = value
+
+    def _loadall(self, data=None):
+        # Replaces all not yet loaded nested dicts in data (by
+        # default self.source) with their actual contents, eg. before
+        # saving.
+        if data is None:
+            data = self.source
+        for (k, v) in data.items():
+            if isinstance(v, _Pending):
+                v = data[k] = v.load()
+            if isinstance(v, dict):
+                self._loadall(v)
+
+    def _includerefs(self, data, filename, load):
+        # Returns a copy of data (loaded from filename) where every
+        # object with a "$ref" key, like {"$ref": "common/db.json"},
+        # is replaced with the content of the referenced file (with a
+        # path relative to filename), loaded by calling load with a
+        # file object opened in binary mode. Any other keys in the
+        # object override keys in the referenced content.
+        filename = os.path.abspath(filename)
+        return _resolverefs(data, filename, load, (filename,))
+
+
+class _Pending(dict):
+    # A placeholder for a nested dict that hasn't been loaded yet, used
+    # by sources that load their data lazily. It's an (empty) dict so
+    # that DictSource treats it as a subsection. The actual dict is
+    # created by calling load(), which calls loader with args, and
+    # replaces the placeholder when DictSource.subsection is called.
+
+    def __init__(self, loader, *args):
+        self.loader = loader
+        self.args = args
+
+    def load(self):
+        return self.loader(*self.args)
+
+
+def _decode(data, encoding):
+    # Returns a copy of data where all bytes objects, as keys or
+    # values at any depth, are decoded to str. Used by sources whose
+    # parsers may return bytes (eg. pyyaml on py2, plistlib for
+    # <data> elements), so that this is done once when loading
+    # instead of every time a value is read.
+    if isinstance(data, bytes):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            # binary data that isn't meant to be a string
+            return data
+    elif isinstance(data, dict):
+        return dict((_decode(k, encoding), _decode(v, encoding))
+                    for (k, v) in data.items())
+    elif isinstance(data, list):
+        return [_decode(v, encoding) for v in data]
+    else:
+        return data
+
+
+# (filename, load) -> (mtime, size, data) for all files referenced
+# through "$ref". The cached data is never modified, since
+# _resolverefs always creates new dicts and lists.
+_refcache = {}
+
+
+def _loadref(filename, load):
+    stat = os.stat(filename)
+    cached = _refcache.get((filename, load))
+    if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    with open(filename, "rb") as fp:
+        data = load(fp)
+    _refcache[(filename, load)] = (stat.st_mtime, stat.st_size, data)
+    return data
+
+
+def _resolverefs(data, filename, load, stack):
+    # stack is the chain of files that includes the current one, used
+    # to detect circular references.
+    if isinstance(data, dict):
+        ref = data.get("$ref")
+        if isinstance(ref, six.string_types):
+            reffile = os.path.normpath(
+                os.path.join(os.path.dirname(filename), ref))
+            if reffile in stack:
+                raise ValueError("Circular $ref: %s" %
+                                 " -> ".join(stack + (reffile,)))
+            result = _resolverefs(_loadref(reffile, load), reffile, load,
+                                  stack + (reffile,))
+            if len(data) > 1:
+                if not isinstance(result, dict):
+                    raise ValueError("%s (referenced from %s) doesn't "
+                                     "contain an object, and can't be "
+                                     "combined with other keys" %
+                                     (reffile, filename))
+                for (k, v) in data.items():
+                    if k != "$ref":
+                        result[k] = _resolverefs(v, filename, load, stack)
+            return result
+        return dict((k, _resolverefs(v, filename, load, stack))
+                    for (k, v) in data.items())
+    elif isinstance(data, list):
+        return [_resolverefs(v, filename, load, stack) for v in data]
+    else:
+        return data
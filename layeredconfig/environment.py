@@ -1,4 +1,9 @@
 import os
+try:
+    from collections import OrderedDict
+except ImportError:  # pragma: no cover
+    # if on python 2.6
+    from ordereddict import OrderedDict
 
 from . import ConfigSource
 
@@ -39,46 +44,93 @@ class Environment(ConfigSource):
         self.source = environ
         self.prefix = prefix
         self.sectionsep = sectionsep
+        # The lowercased, prefix-less names of all variables starting
+        # with prefix, split on sectionsep into a tree of _EnvNode
+        # objects. The tree is built once and shared by all
+        # subsection objects, which only differ in self.path, the
+        # names of the nodes leading to their section. See refresh().
+        if 'index' in kwargs:
+            self.index = kwargs['index']
+            self.path = kwargs['path']
+        else:
+            self.index = _EnvNode()
+            self.path = ()
+            self.refresh()
+
+    def refresh(self):
+        """Re-reads the names of all environment variables. The names
+        are read when the root Environment object is created, so
+        variables added (or removed) after that, other than through
+        :py:meth:`set`, aren't noticed until this is called. This
+        affects all subsections of the same root object.
+
+        """
+        root = _EnvNode()
+        for name in self.source.keys():
+            if name.startswith(self.prefix):
+                parts = name.lower()[len(self.prefix):].split(self.sectionsep)
+                node = root
+                for part in parts[:-1]:
+                    if part not in node.sections:
+                        node.sections[part] = _EnvNode()
+                    node = node.sections[part]
+                node.keys[parts[-1]] = name
+        self.index.keys = root.keys
+        self.index.sections = root.sections
+
+    def _node(self, create=False):
+        # returns the node for this section, or None if it doesn't
+        # exist (eg. after a refresh)
+        node = self.index
+        for part in self.path:
+            if part not in node.sections:
+                if not create:
+                    return None
+                node.sections[part] = _EnvNode()
+            node = node.sections[part]
+        return node
 
-    # used by both keys and subsections, but in different ways
-    def _internalkeys(self):
-        return  [x.lower()[len(self.prefix):] for x in self.source.keys() if x.startswith(self.prefix)]
-        
     def keys(self):
-        for x in self._internalkeys():
-            if self.sectionsep not in x:
-                yield x
+        node = self._node()
+        return list(node.keys) if node else []
 
     def has(self, key):
-        # reverse the prefix/lowerize stuff
-        k = self.prefix + key.upper()
-        return k in self.source
+        node = self._node()
+        return bool(node) and key.lower() in node.keys
 
     def get(self, key):
-        k = self.prefix + key.upper()
-        return self.source[k]
+        return self.source[self._node().keys[key.lower()]]
 
     def set(self, key, val):
-        k = self.prefix + key.upper()
-        self.source[k] = val
+        node = self._node(create=True)
+        key = key.lower()
+        if key not in node.keys:
+            node.keys[key] = self.prefix + self.sectionsep.join(
+                self.path + (key,)).upper()
+        self.source[node.keys[key]] = val
 
     def typed(self, key):
         return False
 
     def subsections(self):
-        yielded = set()
-        for x in self._internalkeys():
-            if self.sectionsep in x:
-                section = x.split(self.sectionsep)[0]
-                if section not in yielded:
-                    yield(section)
-                    yielded.add(section)
+        node = self._node()
+        return list(node.sections) if node else []
 
     def subsection(self, key):
-        s = key.upper() + self.sectionsep
-        newenviron = dict([(k.replace(s,"", 1), v) for k, v in self.source.items() if s in k])
-        return Environment(newenviron,
+        return Environment(self.source,
                            prefix=self.prefix,
                            sectionsep=self.sectionsep,
+                           index=self.index,
+                           path=self.path + (key.lower(),),
                            parent=self,
                            identifier=self.identifier)
+
+
+class _EnvNode(object):
+    __slots__ = ('keys', 'sections')
+
+    def __init__(self):
+        # name -> the name of the environment variable
+        self.keys = OrderedDict()
+        # name -> _EnvNode
+        self.sections = OrderedDict()
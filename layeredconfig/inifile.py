@@ -1,6 +1,9 @@
 import codecs
+import glob
 import logging
+import mmap
 import os
+import re
 import sys
 import six
 from six.moves import configparser
@@ -20,6 +23,8 @@ class INIFile(ConfigSource):
                  rootsection="__root__",
                  sectionsep=".",
                  writable=True, 
+                 engine="configparser",
+                 incremental=False,
                  **kwargs):
         """Loads and optionally saves configuration files in INI format, as
         handled by :py:mod:`configparser`.
@@ -29,7 +34,15 @@ class INIFile(ConfigSource):
                         section, by default named ``__root__``, whose
                         keys are turned into top-level configuration
                         parameters. Any other sections in this file
-                        are turned into nested config objects.
+                        are turned into nested config objects. This
+                        can also be a directory or a glob pattern
+                        like ``/etc/app/conf.d/*.ini`` (a directory
+                        is treated as ``directory/*.ini``), in which
+                        case all matching files are read and
+                        merged in lexical order, later files
+                        overriding earlier ones. Such a source is
+                        never writable, and always uses the
+                        ``"configparser"`` engine.
         :type inifile: str
         :param rootsection: An alternative name for the top-level section. 
                             See note below. 
@@ -41,6 +54,22 @@ class INIFile(ConfigSource):
                          that has this INIFile object amongst its
                          sources should be saved in the INI file.
         :type writable: bool
+        :param engine: The parser used to read the file. The default,
+                       ``"configparser"``, uses :py:mod:`configparser`.
+                       ``"mmap"`` uses a faster parser that
+                       memory-maps the file and only parses a section
+                       the first time something in it is requested.
+                       Section headers must start at the beginning of
+                       a line. Files read with this parser can't be
+                       saved, ie. ``writable`` is always False.
+        :type engine: str
+        :param incremental: If True, saving only rewrites the lines
+                            of the INI file that hold changed values,
+                            and adds new keys and sections, leaving
+                            comments and formatting of the rest of
+                            the file intact. If False, the entire
+                            file is rewritten by :py:mod:`configparser`.
+        :type incremental: bool
 
         .. note::
          
@@ -61,25 +90,43 @@ class INIFile(ConfigSource):
 
         """
         super(INIFile, self).__init__(**kwargs)
-        if inifilename:
+        if engine == "mmap":
+            writable = False
+        # an existing file is always read as such, even if its name
+        # happens to contain glob characters
+        if inifilename and not os.path.isfile(inifilename) and (
+                os.path.isdir(inifilename) or glob.has_magic(inifilename)):
+            if os.path.isdir(inifilename):
+                pattern = os.path.join(inifilename, "*.ini")
+            else:
+                pattern = inifilename
+            fragments = sorted(glob.glob(pattern))
+            if not fragments:
+                logging.warning("No INI files matching %s" % pattern)
+            self.source = _mergeini([_readfragment(f) for f in fragments])
+            if (rootsection != "DEFAULT" and
+                    not self.source.has_section(rootsection)):
+                self.source.add_section(rootsection)
+            self.inifilename = inifilename
+            # there is no single file to save changes to
+            writable = False
+        elif inifilename:
             if not os.path.exists(inifilename):
                 logging.warning("INI file %s does not exist" % inifilename)
-                # create a empty RawConfigParser (Raw to avoid the
-                # interpolation behaviour of other classes)
-                self.source = configparser.RawConfigParser(dict_type=OrderedDict)
+                if engine == "mmap":
+                    self.source = _MappedINI()
+                else:
+                    # create a empty RawConfigParser (Raw to avoid the
+                    # interpolation behaviour of other classes)
+                    self.source = configparser.RawConfigParser(dict_type=OrderedDict)
                 self.inifilename = inifilename
                 if rootsection != "DEFAULT":
                     self.source.add_section(rootsection)
+            elif engine == "mmap":
+                self.source = _MappedINI(inifilename)
+                self.inifilename = inifilename
             else:
-                self.source = configparser.RawConfigParser(dict_type=OrderedDict)
-                if sys.version_info >= (3,2):
-                    reader = self.source.read_file
-                else:
-                    reader = self.source.readfp
-                # we don't know the encoding of this file; assume utf-8
-                with codecs.open(inifilename, encoding="utf-8") as fp:
-                    reader(fp)
-                
+                self.source = _readini(inifilename)
                 self.inifilename = inifilename
         # only used when creating new INIFile objects internally
         elif 'config' in kwargs:  
@@ -96,26 +143,42 @@ class INIFile(ConfigSource):
             self.sectionkey = rootsection
             self.dirty = False
         self.writable = writable
+        self.incremental = incremental
         self.rootsection = rootsection
         self.sectionsep = sectionsep
+        # A trie of all section names, split on sectionsep, shared by
+        # all INIFile objects using the same self.source
+        if 'index' in kwargs:
+            self.index = kwargs['index']
+        else:
+            self.index = OrderedDict()
+            for section in self.source.sections():
+                self._addtoindex(section)
+
+    def _addtoindex(self, section):
+        if section != self.rootsection:
+            node = self.index
+            for name in section.split(self.sectionsep):
+                node = node.setdefault(name, OrderedDict())
 
     def typed(self, key):
         # INI files carry no intrinsic type information
         return False
 
     def subsections(self):
-        # self.source may be None if we provided the path to a
-        # nonexistent inifile (this should probably throw an exception
-        # instead)
-        if not self.source:
-            return []
+        if self.sectionkey == self.rootsection:
+            # only sections that exist in their own right, ie not
+            # [mymodule] if the file only contains [mymodule.arbitrary]
+            return [x for x in self.index if self.source.has_section(x)]
         else:
-            allsections = [x for x in self.source.sections() if x != self.rootsection]
-            if self.sectionkey != self.rootsection:
-                # find out what subsections are under this subsection (eg nested sections)
-                return [x[len(self.sectionkey+self.sectionsep):].split(self.sectionsep)[0] for x in allsections if x.startswith(self.sectionkey+self.sectionsep)]
-            else:
-                return [x for x in allsections if self.sectionsep not in x]
+            # find out what subsections are under this subsection (eg
+            # nested sections)
+            node = self.index
+            for name in self.sectionkey.split(self.sectionsep):
+                if name not in node:
+                    return []
+                node = node[name]
+            return list(node)
 
     def subsection(self, key):
         if self.sectionkey == self.rootsection:
@@ -123,7 +186,9 @@ class INIFile(ConfigSource):
         else:
             section = self.sectionkey + self.sectionsep + key
         return INIFile(config=self.source, section=section,
-                       parent=self, identifier=self.identifier)
+                       index=self.index, rootsection=self.rootsection,
+                       sectionsep=self.sectionsep, parent=self,
+                       identifier=self.identifier)
 
     def has(self, key):
         if self.sectionkey == "DEFAULT":
@@ -135,6 +200,10 @@ class INIFile(ConfigSource):
         return str(self.source.get(self.sectionkey, key))
 
     def set(self, key, value):
+        if (self.sectionkey != "DEFAULT" and
+                not self.source.has_section(self.sectionkey)):
+            self.source.add_section(self.sectionkey)
+            self._addtoindex(self.sectionkey)
         self.source.set(self.sectionkey, key, self._strvalue(value))
 
     def keys(self):
@@ -145,6 +214,316 @@ class INIFile(ConfigSource):
     def save(self):
         # this should only be called on root objects
         assert not self.parent, "save() should only be called on root objects"
-        if self.inifilename:
-            with open(self.inifilename, "w") as fp:
+        if not self.inifilename:
+            return
+        if (self.incremental and self.changed is not None and
+                os.path.exists(self.inifilename)):
+            with codecs.open(self.inifilename, encoding="utf-8") as fp:
+                lines = fp.read().splitlines(True)
+            lines = self._patch(lines)
+            with self._atomicfile(self.inifilename, encoding="utf-8") as fp:
+                fp.write("".join(lines))
+        else:
+            with self._atomicfile(self.inifilename) as fp:
                 self.source.write(fp)
+
+    def _patch(self, lines):
+        # Returns a copy of lines (the existing INI file) with the
+        # values in self.changed updated or added.
+        newline = "\n"
+        if lines and lines[0].endswith("\r\n"):
+            newline = "\r\n"
+
+        # find out where each key (and its continuation lines, if
+        # any) is, and where each section ends
+        keys = {}      # (section, key) -> (first line, last line + 1)
+        sections = OrderedDict()  # section -> line after last key
+        section = key = None
+        for idx, line in enumerate(lines):
+            stripped = line.strip()
+            if not stripped or stripped[0] in "#;":
+                continue
+            indent = len(line) - len(line.lstrip())
+            if key is not None and indent > keyindent:
+                keys[key] = (keys[key][0], idx + 1)
+                sections[section] = idx + 1
+            elif stripped.startswith("[") and "]" in stripped:
+                section = stripped[1:stripped.index("]")]
+                sections[section] = idx + 1
+                key = None
+            elif section is not None:
+                delims = [x for x in (line.find("="), line.find(":"))
+                          if x != -1]
+                if delims:
+                    key = (section,
+                           self.source.optionxform(line[:min(delims)].strip()))
+                    keyindent = indent
+                    keys[key] = (idx, idx + 1)
+                    sections[section] = idx + 1
+
+        replace = {}        # first line -> (last line + 1, new lines)
+        insert = {}         # line -> list of new lines
+        append = OrderedDict()  # new section -> list of new lines
+        for path in sorted(self.changed):
+            if len(path) == 1:
+                section = self.rootsection
+            else:
+                section = self.sectionsep.join(path[:-1])
+            name = self.source.optionxform(path[-1])
+            if not self.source.has_option(section, name):
+                continue
+            value = self.source.get(section, name)
+            entry = "%s = %s%s" % (name,
+                                   str(value).replace("\n", newline + "\t"),
+                                   newline)
+            if (section, name) in keys:
+                start, end = keys[(section, name)]
+                replace[start] = (end, [entry])
+            elif section in sections:
+                insert.setdefault(sections[section], []).append(entry)
+            else:
+                append.setdefault(section, []).append(entry)
+
+        result = []
+        idx = 0
+        while idx <= len(lines):
+            if idx in insert:
+                if result and not result[-1].endswith("\n"):
+                    result[-1] += newline
+                result.extend(insert[idx])
+            if idx == len(lines):
+                break
+            if idx in replace:
+                end, entries = replace[idx]
+                result.extend(entries)
+                idx = end
+            else:
+                result.append(lines[idx])
+                idx += 1
+        for section, entries in append.items():
+            if result:
+                if not result[-1].endswith("\n"):
+                    result[-1] += newline
+                if result[-1].strip():
+                    result.append(newline)
+            result.append("[%s]%s" % (section, newline))
+            result.extend(entries)
+        return result
+
+
+def _readini(filename):
+    # create a RawConfigParser (Raw to avoid the interpolation
+    # behaviour of other classes) and read filename into it
+    parser = configparser.RawConfigParser(dict_type=OrderedDict)
+    if sys.version_info >= (3,2):
+        reader = parser.read_file
+    else:
+        reader = parser.readfp
+    # we don't know the encoding of this file; assume utf-8
+    with codecs.open(filename, encoding="utf-8") as fp:
+        reader(fp)
+    return parser
+
+
+# absolute filename -> (mtime, size, parser) for files read as
+# fragments of a conf.d style directory. The cached parsers are never
+# modified.
+_fragmentcache = {}
+
+
+def _readfragment(filename):
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    cached = _fragmentcache.get(filename)
+    if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    parser = _readini(filename)
+    _fragmentcache[filename] = (stat.st_mtime, stat.st_size, parser)
+    return parser
+
+
+def _mergeini(parsers):
+    # returns a new RawConfigParser with the sections and values of
+    # all parsers, values in later parsers overriding earlier ones.
+    merged = configparser.RawConfigParser(dict_type=OrderedDict)
+    for parser in parsers:
+        for key, value in parser.defaults().items():
+            merged.set("DEFAULT", key, value)
+        # parser.options() and parser.items() include values from
+        # [DEFAULT], so use the section's own dict
+        for section, values in parser._sections.items():
+            if not merged.has_section(section):
+                merged.add_section(section)
+            for key, value in values.items():
+                if key != "__name__":  # added by py2 configparser
+                    merged.set(section, key, value)
+    return merged
+
+
+class _MappedINI(object):
+    # A read-only replacement for RawConfigParser, used by INIFile
+    # when engine="mmap". The file is memory-mapped, and when loading,
+    # only the positions of the section headers are found. The
+    # key/value lines of a section are parsed the first time anything
+    # in that section is requested, building an index from keys to
+    # the byte offsets of each value. Values are only decoded when
+    # requested. Only the subset of the RawConfigParser API that
+    # INIFile needs is implemented. Values can be set, but are only
+    # kept in memory.
+
+    # unlike configparser, section headers must start at the beginning
+    # of the line
+    header = re.compile(br"^\[([^\]\r\n]*)\]", re.MULTILINE)
+
+    def __init__(self, filename=None, encoding="utf-8"):
+        self.filename = filename
+        self.encoding = encoding
+        self.data = b""
+        # section name -> list of (start, end) byte offsets of the
+        # body of each [section] block with that name
+        self._spans = OrderedDict()
+        # section name -> OrderedDict of key -> value, where value is
+        # either a (start, end) tuple of byte offsets in self.data or
+        # an already decoded string. Sections are added when parsed.
+        self._sections = {}
+        self._defaults = None
+        if filename:
+            with open(filename, "rb") as fp:
+                if os.fstat(fp.fileno()).st_size:
+                    self.data = mmap.mmap(fp.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+            self._scan()
+
+    def _scan(self):
+        name = None
+        pos = 0
+        for match in self.header.finditer(self.data):
+            if name is None:
+                # anything but comments before the first section
+                # header is an error
+                self._parse(0, match.start(), None)
+            else:
+                self._spans[name].append((pos, match.start()))
+            name = match.group(1).decode(self.encoding)
+            self._spans.setdefault(name, [])
+            pos = match.end()
+        if name is None:
+            self._parse(0, len(self.data), None)
+        else:
+            self._spans[name].append((pos, len(self.data)))
+
+    def _section(self, name):
+        # returns the parsed section, or None if it doesn't exist
+        if name not in self._sections:
+            if name not in self._spans:
+                return None
+            section = OrderedDict()
+            for (start, end) in self._spans[name]:
+                self._parse(start, end, section)
+            self._sections[name] = section
+        return self._sections[name]
+
+    def _parse(self, pos, end, section):
+        data = self.data
+        key = None  # the key whose value may continue on the next line
+        while pos < end:
+            nl = data.find(b"\n", pos, end)
+            if nl == -1:
+                nl = end
+            line = data[pos:nl]
+            linestart = pos
+            pos = nl + 1
+            stripped = line.strip()
+            if not stripped or stripped[:1] in (b"#", b";"):
+                continue
+            indent = len(line) - len(line.lstrip())
+            if key is not None and indent > keyindent:
+                # continuation of the previous value
+                start, stop = section[key]
+                section[key] = (start, linestart + len(line.rstrip()))
+                continue
+            if section is None:
+                raise configparser.MissingSectionHeaderError(
+                    self.filename, data[:linestart].count(b"\n") + 1,
+                    line.decode(self.encoding))
+            delims = [idx for idx in (line.find(b"="), line.find(b":"))
+                      if idx != -1]
+            if not delims:
+                raise configparser.ParsingError(self.filename)
+            delim = min(delims)
+            key = line[:delim].strip().decode(self.encoding).lower()
+            keyindent = indent
+            value = line[delim+1:]
+            start = linestart + delim + 1 + len(value) - len(value.lstrip())
+            section[key] = (start, max(start, linestart + len(line.rstrip())))
+
+    @property
+    def _defaultsection(self):
+        if self._defaults is None:
+            self._defaults = self._section("DEFAULT")
+            if self._defaults is None:
+                self._defaults = OrderedDict()
+        return self._defaults
+
+    def _value(self, value):
+        if isinstance(value, tuple):
+            value = self.data[value[0]:value[1]].decode(self.encoding)
+            if "\n" in value:
+                # a multi-line value, which might contain comments
+                lines = value.splitlines()
+                value = "\n".join([lines[0].strip()] +
+                                  [x.strip() for x in lines[1:]
+                                   if not x.strip().startswith(("#", ";"))])
+        return value
+
+    def sections(self):
+        return [x for x in self._spans if x != "DEFAULT"]
+
+    def has_section(self, section):
+        return section != "DEFAULT" and section in self._spans
+
+    def add_section(self, section):
+        if self.has_section(section):
+            raise configparser.DuplicateSectionError(section)
+        self._spans[section] = []
+
+    def has_option(self, section, option):
+        option = option.lower()
+        if not section or section == "DEFAULT":
+            return option in self._defaultsection
+        elif not self.has_section(section):
+            return False
+        else:
+            return (option in self._section(section) or
+                    option in self._defaultsection)
+
+    def options(self, section):
+        if not self.has_section(section):
+            raise configparser.NoSectionError(section)
+        options = list(self._section(section))
+        return options + [x for x in self._defaultsection if x not in options]
+
+    def defaults(self):
+        return OrderedDict((k, self._value(v))
+                           for (k, v) in self._defaultsection.items())
+
+    def get(self, section, option):
+        option = option.lower()
+        if section != "DEFAULT":
+            if not self.has_section(section):
+                raise configparser.NoSectionError(section)
+            values = self._section(section)
+            if option in values:
+                return self._value(values[option])
+        if option in self._defaultsection:
+            return self._value(self._defaultsection[option])
+        else:
+            raise configparser.NoOptionError(option, section)
+
+    def set(self, section, option, value):
+        if not section or section == "DEFAULT":
+            self._defaultsection[option.lower()] = value
+        elif not self.has_section(section):
+            raise configparser.NoSectionError(section)
+        else:
+            self._section(section)[option.lower()] = value
@@ -1,12 +1,165 @@
 import json
+from json.decoder import scanstring
+import logging
+import os
+import re
 from six import text_type as str
 
 from . import DictSource
+from .dictsource import _Pending
+
+
+def _stdlibload(fp):
+    return json.load(fp)
+
+
+def _stdlibdump(data, fp, default):
+    json.dump(data, fp, indent=4, separators=(',',': '), sort_keys=True,
+              default=default)
+
+
+def _orjsonload(fp):
+    import orjson
+    return orjson.loads(fp.read())
+
+
+def _orjsondump(data, fp, default):
+    import orjson
+    # orjson only supports indenting with two spaces. Dates and
+    # datetimes are passed to default, like with the other backends.
+    fp.write(orjson.dumps(data, default=default,
+                          option=(orjson.OPT_INDENT_2 |
+                                  orjson.OPT_SORT_KEYS |
+                                  orjson.OPT_PASSTHROUGH_DATETIME)))
+
+
+def _ujsonload(fp):
+    import ujson
+    return ujson.load(fp)
+
+
+def _ujsondump(data, fp, default):
+    import ujson
+    fp.write(ujson.dumps(data, indent=4, sort_keys=True, default=default,
+                         escape_forward_slashes=False))
+
+
+# The JSON libraries that JSONFile can use, in order of preference
+# when backend="auto". For each: the load function (which is given a
+# file opened in binary mode), the dump function, and the mode that the
+# file passed to it should be opened with.
+_backends = [("orjson", _orjsonload, _orjsondump, "wb"),
+             ("ujson", _ujsonload, _ujsondump, "w"),
+             ("json", _stdlibload, _stdlibdump, "w")]
+
+
+def _available(name):
+    if name == "json":
+        return True
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+
+
+def _selectbackend(backend):
+    # returns the name of the backend to use
+    names = [x[0] for x in _backends]
+    if backend is None:
+        backend = os.environ.get("LAYEREDCONFIG_JSON_BACKEND", "json")
+    if backend == "auto":
+        return [x for x in names if _available(x)][0]
+    elif backend not in names:
+        raise ValueError("Unknown JSON backend %r, use one of %s or 'auto'" %
+                         (backend, ", ".join(names)))
+    elif not _available(backend):
+        logging.warning("JSON backend %s is not installed, using json" %
+                        backend)
+        return "json"
+    else:
+        return backend
+
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def _lazyload(text):
+    # Decodes the JSON object in text, except that objects nested
+    # directly in it are not decoded, but represented by _Pending
+    # placeholders that decode them when needed. Raises ValueError or
+    # IndexError if text doesn't look like a JSON object.
+    decoder = json.JSONDecoder()
+    ws = _whitespace.match
+    load = _subtreeloader(text)
+    result = {}
+    pos = ws(text, 0).end()
+    if text[pos] != "{":
+        raise ValueError("Not a JSON object")
+    pos = ws(text, pos + 1).end()
+    while text[pos] != "}":
+        if text[pos] != '"':
+            raise ValueError("Expected a key at %s" % pos)
+        key, pos = scanstring(text, pos + 1)
+        pos = ws(text, pos).end()
+        if text[pos] != ":":
+            raise ValueError("Expected ':' at %s" % pos)
+        pos = ws(text, pos + 1).end()
+        if text[pos] == "{":
+            end = _objectend(text, pos)
+            result[key] = _Pending(load, pos, end, key)
+        else:
+            result[key], end = decoder.raw_decode(text, pos)
+        pos = ws(text, end).end()
+        if text[pos] == ",":
+            pos = ws(text, pos + 1).end()
+        elif text[pos] != "}":
+            raise ValueError("Expected ',' or '}' at %s" % pos)
+    if text[pos + 1:].strip():
+        raise ValueError("Extra data at %s" % pos)
+    return result
+
+
+def _objectend(text, pos):
+    # Returns the position after the end of the JSON object that
+    # starts at pos, by finding the first "}" after which there are as
+    # many "}" as "{", and an even number of (unescaped) quotes, ie
+    # the "}" isn't in a string. This is much faster than decoding
+    # the object, but can be fooled by strings ending with an escaped
+    # backslash. In that case either this raises ValueError, or
+    # decoding the span fails, which _subtreeloader handles.
+    depth = 0
+    start = pos
+    while True:
+        end = text.find("}", start) + 1
+        if not end:
+            raise ValueError("Unterminated object at %s" % pos)
+        depth += text.count("{", start, end) - 1
+        start = end
+        if (depth == 0 and
+            (text.count('"', pos, end) -
+             text.count('\\"', pos, end)) % 2 == 0):
+            return end
+
+
+def _subtreeloader(text):
+    def load(start, end, key):
+        try:
+            return json.loads(text[start:end])
+        except ValueError:
+            # _objectend got it wrong. Decode the entire document
+            # instead.
+            return json.loads(text)[key]
+    return load
 
 
 class JSONFile(DictSource):
 
-    def __init__(self, jsonfilename=None, writable=True, **kwargs):
+    backend = "json"
+    """The name of the JSON library used to load and save the file."""
+
+    def __init__(self, jsonfilename=None, writable=True, backend=None,
+                 lazy=False, includes=False, **kwargs):
         """Loads and optionally saves configuration files in JSON
         format. Since JSON has some support for typed values (supports
         numbers, lists, bools, but not dates or datetimes), data from
@@ -21,6 +174,34 @@ class JSONFile(DictSource):
                          that has this JSONFile object amongst its
                          sources should be saved in the JSON file.
         :type writable: bool
+        :param backend: The JSON library to use, either ``"json"``
+                        (the standard library), ``"orjson"``,
+                        ``"ujson"`` or ``"auto"`` (the fastest one
+                        installed). If not given, the environment
+                        variable ``LAYEREDCONFIG_JSON_BACKEND`` is
+                        used, and if that isn't set, ``"json"``. If
+                        the requested library isn't installed, the
+                        standard library is used. Note that files
+                        saved with ``"orjson"`` are indented with two
+                        spaces instead of four.
+        :type backend: str
+        :param lazy: If True, objects nested in the root object are
+                     not decoded when the file is loaded, only when
+                     their subsection is first accessed. This saves
+                     time and memory for large files where only some
+                     subsections are used. The standard library is
+                     always used for decoding in this mode.
+        :type lazy: bool
+        :param includes: If True, any object with a ``"$ref"`` key,
+                         like ``{"$ref": "common/db.json"}``, is
+                         replaced with the content of that JSON file
+                         (relative to this file). Other keys in the
+                         object override keys from the referenced
+                         file. Referenced files are only parsed once
+                         per process, unless they change. Sources
+                         using includes are never writable, and
+                         ``lazy`` is ignored.
+        :type includes: bool
 
         """
         super(JSONFile, self).__init__(**kwargs)
@@ -31,8 +212,24 @@ class JSONFile(DictSource):
         elif kwargs.get('empty', False):
             self.source = {}
         else:
-            with open(jsonfilename) as fp:
-                self.source = json.load(fp)
+            self.backend = _selectbackend(backend)
+            load = [x[1] for x in _backends if x[0] == self.backend][0]
+            with open(jsonfilename, "rb") as fp:
+                if lazy and not includes:
+                    text = fp.read().decode("utf-8")
+                    try:
+                        self.source = _lazyload(text)
+                    except (ValueError, IndexError):
+                        # let json raise a proper error (or decode
+                        # something _lazyload couldn't handle)
+                        self.source = json.loads(text)
+                else:
+                    self.source = load(fp)
+            if includes:
+                self.source = self._includerefs(self.source, jsonfilename,
+                                                load)
+                # saving would replace the references with their content
+                writable = False
             self.jsonfilename = jsonfilename
             self.dirty = False
         self.writable = writable
@@ -40,17 +237,15 @@ class JSONFile(DictSource):
     def typed(self, key):
         # if the value is anything other than a string, we can be sure
         # that it contains useful type information.
-        
-        return self.has(key) and not isinstance(self.get(key), str)
 
-    def set(self, key, value):
-        # simple stringification -- should perhaps only be done in the
-        # save step through a method passed as a default parameter to
-        # json dumps
-        self.source[key] = str(value)
+        return self.has(key) and not isinstance(self.get(key), str)
 
     def save(self):
         assert not self.parent, "save() should only be called on root objects"
         if self.jsonfilename:
-            with open(self.jsonfilename, "w") as fp:
-                json.dump(self.source, fp, indent=4, separators=(',',': '), sort_keys=True)
+            self._loadall()
+            dump, mode = [x[2:] for x in _backends if x[0] == self.backend][0]
+            with self._atomicfile(self.jsonfilename, mode) as fp:
+                # values that JSON can't represent, like dates and
+                # datetimes, are stored as strings
+                dump(self.source, fp, default=self._strvalue)
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
+from contextlib import contextmanager
 import itertools
 import logging
+import threading
+import time
 from datetime import datetime, date
+from timeit import default_timer as timer
 
 try:
     from collections import OrderedDict
@@ -44,6 +48,18 @@ class LayeredConfig(object):
                          ``True`` by default. This does not affect
                          :py:meth:`~Layeredconfig.set`.
         :type writable: bool
+        :param instrument: Whether to count calls to the underlying
+                           sources and measure how much time they
+                           spend, see :py:meth:`~LayeredConfig.stats`.
+                           ``False`` by default.
+        :type instrument: bool
+        :param asyncwrite: If True, :py:meth:`~LayeredConfig.write`
+                           returns immediately and sources are saved
+                           by a background thread, which coalesces
+                           bursts of writes into a single save per
+                           source. See :py:meth:`~LayeredConfig.flush`.
+                           ``False`` by default.
+        :type asyncwrite: bool
 
         """
         self._sources = sources
@@ -52,58 +68,98 @@ class LayeredConfig(object):
         self._writable = kwargs.get('writable', True)
         self._parent = None
         self._sectionkey = None
+        # the assignments buffered by an open transaction, kept per
+        # thread so that other threads' assignments aren't part of it
+        self._transaction = threading.local()
+        if kwargs.get('asyncwrite', False):
+            self._writer = _BackgroundWriter()
+        else:
+            self._writer = None
+        # all LayeredConfig objects in a tree share the same stats
+        # dict, which is passed on to subsections through the
+        # internal 'stats' argument
+        self._stats = kwargs.get('stats')
+        if self._stats is None and kwargs.get('instrument', False):
+            self._stats = _newstats(self._sources)
+        if self._stats is not None:
+            for idx, src in enumerate(self._sources):
+                _instrument(src, self._stats['sources'][idx])
 
         # Each source may have any number of named subsections. We
         # create a LayeredConfig object for each name, and stuff all
         # matching subections from each of our sources in it.
         #
         # 1. find all names
-        sectionkeys = []
+        sectionkeys = OrderedDict()
+        available = []  # the subsection names of each source
         for src in self._sources:
             try:
-                for k in src.subsections():
-                    if k not in sectionkeys:
-                        sectionkeys.append(k)
+                keys = list(src.subsections())
             except AttributeError:  # possibly others, or all
                 # we couldn't get any subsections for source, perhaps
                 # because it's an "empty" source. Well, that's ok.
-                pass
-
+                keys = []
+            available.append(set(keys))
+            for k in keys:
+                sectionkeys[k] = True
+
+        # 2. unless some source needs to see the entire tree of
+        # config objects in its setup method, the LayeredConfig
+        # objects for each subsection are created when first
+        # accessed, see _getsubsection. All objects in a tree do the
+        # same, which is decided by the root object.
+        self._available = available
+        self._lazy = kwargs.get('lazy')
+        if self._lazy is None:
+            self._lazy = not any(_hassetup(src) for src in self._sources)
         for k in sectionkeys:
-            # 2. find all subsections in all of our sources
-            s = []
-            for src in self._sources:
-                if k in list(src.subsections()):
-                    s.append(src.subsection(k))
-                else:
-                    # create an "empty" subsection object. It's
-                    # important that all the LayeredConfig objects in a
-                    # tree have the exact same set of
-                    # ConfigSource-derived types.
-                    # print("creating empty %s" % src.__class__.__name__)
-                    s.append(src.__class__(parent=src,
-                                           identifier=src.identifier,
-                                           writable=src.writable,
-                                           empty=True,
-                                           cascade=self._cascade))
-            # 3. create a LayeredConfig object for the subsection
-            c = self.__class__(*s,
-                               cascade=self._cascade,
-                               writable=self._writable)
-            c._sectionkey = k
-            c._parent = self
-            self._subsections[k] = c
-
-        # 4. give each source a chance to to some post-init setup.
+            if self._lazy:
+                self._subsections[k] = None
+            else:
+                self._subsections[k] = self._makesubsection(k)
+
+        # 5. give each source a chance to to some post-init setup.
         for src in self._sources:
             src.setup(self)
 
+    def _makesubsection(self, key):
+        # 3. find all subsections with this name in all of our sources
+        s = []
+        for src, keys in zip(self._sources, self._available):
+            if key in keys:
+                s.append(src.subsection(key))
+            else:
+                # use a placeholder for the missing subsection. It's
+                # important that all the LayeredConfig objects in a
+                # tree have one source for each source in the root
+                # object, in the same order.
+                s.append(_absentsource(src))
+        # 4. create a LayeredConfig object for the subsection
+        c = self.__class__(*s,
+                           cascade=self._cascade,
+                           writable=self._writable,
+                           stats=self._stats,
+                           lazy=self._lazy)
+        c._sectionkey = key
+        c._parent = self
+        return c
+
+    def _getsubsection(self, key):
+        c = self._subsections[key]
+        if c is None:
+            c = self._makesubsection(key)
+            if self._subsections[key] is None:
+                self._subsections[key] = c
+            c = self._subsections[key]
+        return c
+
     @staticmethod
     def write(config):
         """Commits any pending modifications, ie save a configuration file if
         it has been marked "dirty" as a result of an normal
         assignment. The modifications are written to the first
-        writable source in this config object.
+        writable source in this config object. Sources that haven't
+        been changed since they were last saved are not written.
 
         .. note::
 
@@ -120,9 +176,77 @@ class LayeredConfig(object):
         while root._parent:
             root = root._parent
 
-        for source in root._sources:
-            if source.writable and source.dirty:
+        dirty = [source for source in root._sources
+                 if source.writable and source.dirty]
+        if root._writer is not None:
+            root._writer.enqueue(dirty)
+        else:
+            for source in dirty:
                 source.save()
+                source.dirty = False
+                source.changed = None
+
+    @staticmethod
+    def flush(config):
+        """Waits until all sources queued for saving by
+        :py:meth:`~LayeredConfig.write` have been saved. Only has
+        any effect for config objects created with
+        ``asyncwrite=True``.
+
+        :param config: The configuration object to wait for
+        :type  config: layeredconfig.LayeredConfig
+
+        """
+        root = config
+        while root._parent:
+            root = root._parent
+        if root._writer is not None:
+            root._writer.flush()
+
+    @staticmethod
+    @contextmanager
+    def transaction(config):
+        """Returns a context manager that groups many assignments into a
+        single change. Assignments made within the ``with`` block are
+        buffered and applied when the block exits, after which
+        :py:meth:`~LayeredConfig.write` is called once. If the block
+        raises an exception, the buffered assignments are discarded
+        and the configuration is left untouched::
+
+            with LayeredConfig.transaction(config):
+                config.home = "/var/lib/myapp"
+                config.mymodule.force = True
+
+        .. note::
+
+           Since assignments are buffered, reading a parameter within
+           the block returns the value it had before the transaction
+           started.
+
+        Assigning a parameter that doesn't exist raises
+        :py:exc:`AttributeError` immediately, like it does outside
+        of a transaction. Nested transactions are merged with the
+        outermost one. A transaction only buffers assignments made by
+        the thread that started it; assignments from other threads
+        are applied immediately.
+
+        :param config: The configuration object to change
+        :type  config: layeredconfig.LayeredConfig
+
+        """
+        root = config
+        while root._parent:
+            root = root._parent
+        if getattr(root._transaction, 'pending', None) is not None:
+            yield
+            return
+        pending = root._transaction.pending = []
+        try:
+            yield
+        finally:
+            root._transaction.pending = None
+        root._apply(pending)
+        LayeredConfig.write(config)
 
     @staticmethod
     def set(config, key, value, sourceid="defaults"):
@@ -137,10 +261,23 @@ class LayeredConfig(object):
         :param sourceid: The identifier for the underlying source that the
                          value should be set on.
         """
-        for source in config._sources:
-            if source.identifier == sourceid:
-                source.set(key, value)
-                # What if no source is found? We silently ignore...
+        root = config
+        while root._parent:
+            root = root._parent
+        writer = root._writer
+        if writer is not None:
+            # don't modify sources while they're being saved
+            writer.lock.acquire()
+        try:
+            for idx, source in enumerate(config._sources):
+                if source.identifier == sourceid:
+                    if isinstance(source, _AbsentSource):
+                        source = config._materialize(idx)
+                    source.set(key, value)
+                    # What if no source is found? We silently ignore...
+        finally:
+            if writer is not None:
+                writer.lock.release()
 
     @staticmethod
     def get(config, key, default=None):
@@ -167,14 +304,89 @@ class LayeredConfig(object):
                 return element
 
             section = dict()
-            for key, subsection in element._subsections.items():
-                section[key] = _dump(subsection)
+            for key in element._subsections:
+                section[key] = _dump(element._getsubsection(key))
             for key in element:
                 section[key] = getattr(element, key)
             return section
 
         return _dump(config)
 
+    @staticmethod
+    def stats(config):
+        """Returns the statistics collected for a config object created
+        with ``instrument=True``, or None if the config object isn't
+        instrumented. The statistics cover the entire tree of config
+        objects that *config* is part of, and are returned as a dict
+        with the following keys:
+
+        * ``resolved``: The number of parameter lookups that succeeded.
+        * ``unresolved``: The number of parameter lookups that raised
+          :py:exc:`AttributeError`.
+        * ``sources``: A list with one dict for each source, in the
+          same order as the sources were given to the root config
+          object. Each dict has the ``identifier`` of the source,
+          the number of calls to ``has``,
+          ``get``, ``typed`` and ``typevalue``, the time (in seconds)
+          spent creating subsections and running ``setup``
+          (``construct``), and the number of calls to and time spent
+          in ``save`` (``saves`` and ``save``).
+
+        :param config: The configuration object to get statistics for
+        :type  config: layeredconfig.LayeredConfig
+        :rtype: dict
+
+        """
+        stats = config._stats
+        if stats is None:
+            return None
+        ret = dict(stats)
+        ret['sources'] = [dict(x) for x in stats['sources']]
+        return ret
+
+    @staticmethod
+    def resetstats(config):
+        """Resets all counters returned by
+        :py:meth:`~LayeredConfig.stats` to zero.
+
+        :param config: The configuration object to reset statistics for
+        :type  config: layeredconfig.LayeredConfig
+
+        """
+        stats = config._stats
+        if stats is not None:
+            for counters in [stats] + stats['sources']:
+                for k, v in counters.items():
+                    if isinstance(v, (int, float)):
+                        counters[k] = type(v)(0)
+
+    _tracer = None
+
+    @staticmethod
+    def set_tracer(fn):
+        """Installs a function that is called every time a configuration
+        parameter is looked up on any config object. The function is
+        called with four arguments: the full dotted path of the
+        parameter (eg. ``mymodule.force``), the identifier of the
+        source that provided the value, the identifier of the source
+        that provided typing information and the time (in seconds)
+        spent on the lookup. If the lookup failed, the source
+        identifiers are None. If the value wasn't typed, the
+        typesource identifier is None.
+
+        Call with ``None`` to remove an installed tracer. Lookups
+        don't incur any extra cost when no tracer is installed.
+
+        :param fn: The tracing function, or None
+        :type  fn: callable
+
+        """
+        LayeredConfig._tracer = fn
+        if fn is None:
+            LayeredConfig.__getattr__ = LayeredConfig._plaingetattr
+        else:
+            LayeredConfig.__getattr__ = LayeredConfig._tracinggetattr
+
     # These are methods i'd like to implement next
     #
     #    @staticmethod
@@ -247,8 +459,48 @@ class LayeredConfig(object):
     def __getattr__(self, name):
 
         if name in self._subsections:
-            return self._subsections[name]
+            return self._getsubsection(name)
+
+        if self._stats is None:
+            return self._resolve(name)[0]
+        else:
+            return self._countingresolve(name)[0]
+
+    # Replaces __getattr__ when a tracer is installed through
+    # set_tracer, so that untraced lookups don't pay for tracing
+    def _tracinggetattr(self, name):
 
+        if name in self._subsections:
+            return self._getsubsection(name)
+
+        source = typesource = None
+        start = timer()
+        try:
+            if self._stats is None:
+                value, source, typesource = self._resolve(name)
+            else:
+                value, source, typesource = self._countingresolve(name)
+            return value
+        finally:
+            LayeredConfig._tracer(".".join(self._path() + [name]),
+                                  source and source.identifier,
+                                  typesource and typesource.identifier,
+                                  timer() - start)
+
+    _plaingetattr = __getattr__
+
+    def _countingresolve(self, name):
+        try:
+            ret = self._resolve(name)
+        except AttributeError:
+            self._stats['unresolved'] += 1
+            raise
+        self._stats['resolved'] += 1
+        return ret
+
+    def _resolve(self, name):
+        # returns a (value, source, typesource) tuple, where typesource
+        # is None if no typing information was found
         found = False
         # find the appropriate value in the highest-priority source
         for source in reversed(self._sources):
@@ -268,7 +520,7 @@ class LayeredConfig(object):
 
         if found:
             if source.typed(name):
-                return source.get(name)
+                return source.get(name), source, source
             else:
                 # we need to find a typesource for this value.
                 done = False
@@ -285,37 +537,81 @@ class LayeredConfig(object):
                         done = True
 
                 if typesource.typed(name):
-                    return typesource.typevalue(name, source.get(name))
+                    return (typesource.typevalue(name, source.get(name)),
+                            source, typesource)
                 else:
                     # we can't type this data, return as-is
-                    return source.get(name)
+                    return source.get(name), source, None
         else:
             if self._cascade and self._parent and name not in self._parent._subsections:
-                return self._parent.__getattr__(name)
+                return self._parent._resolve(name)
 
         raise AttributeError("Configuration key %s doesn't exist" % name)
 
+    def _path(self):
+        # the section keys leading from the root config object to this one
+        path = []
+        config = self
+        while config._parent:
+            path.insert(0, config._sectionkey)
+            config = config._parent
+        return path
+
     def __setattr__(self, name, value):
         # print("__setattribute__ %s to %s" % (name,value))
         if name.startswith("_"):
             object.__setattr__(self, name, value)
             return
 
+        root = self
+        while root._parent:
+            root = root._parent
+        pending = getattr(root._transaction, 'pending', None)
+        if pending is not None:
+            # defer the assignment until the transaction is committed,
+            # but fail early if it won't succeed
+            if not self._settable(name):
+                raise AttributeError("Configuration key %s doesn't exist" % name)
+            pending.append((self, name, value))
+            return
+        root._apply([(self, name, value)])
+
+    def _apply(self, assignments):
+        # Performs a list of (config, name, value) assignments. Must
+        # be called on the root config object.
+        writer = self._writer
+        if writer is not None:
+            # don't modify sources while they're being saved
+            writer.lock.acquire()
+        changes = []
+        try:
+            for (config, name, value) in assignments:
+                config._assign(name, value, changes)
+        finally:
+            _markdirty(changes)
+            if writer is not None:
+                writer.lock.release()
+
+    def _assign(self, name, value, changes):
+        # Sets the value in the relevant sources. Every writable
+        # source that's modified is recorded, together with the
+        # config object and the parameter name, in changes.
+
         # we need to get access to two sources:
 
         # 1. the highest-priority writable source (regardless of
         #    whether it originally had this value)
         found = False
-        for writesource in reversed(self._sources):
+        for idx in reversed(range(len(self._sources))):
+            writesource = self._sources[idx]
             if writesource.writable:
                 found = True
                 break
         if found:
+            if isinstance(writesource, _AbsentSource):
+                writesource = self._materialize(idx)
             writesource.set(name, value)
-            writesource.dirty = True
-            while writesource.parent:
-                writesource = writesource.parent
-                writesource.dirty = True
+            changes.append((self, writesource, name))
 
         # 2. the highest-priority source that has this value (typed or
         # not) or contains typing info for it.
@@ -327,6 +623,204 @@ class LayeredConfig(object):
         if found:
             source.set(name, value)  # regardless of typing
         elif self._cascade and self._parent:
-            return self._parent.__setattr__(name, value)
+            return self._parent._assign(name, value, changes)
         else:
             raise AttributeError("Configuration key %s doesn't exist" % name)
+
+    def _materialize(self, idx):
+        # Replaces the placeholder at self._sources[idx] with an
+        # actual, empty, source object that values can be set on.
+        absent = self._sources[idx]
+        cls = absent.parent
+        while isinstance(cls, _AbsentSource):
+            cls = cls.parent
+        cls = cls.__class__
+        source = cls(parent=absent.parent,
+                     identifier=absent.identifier,
+                     writable=absent.writable,
+                     empty=True,
+                     cascade=self._cascade)
+        if self._stats is not None:
+            _instrument(source, self._stats['sources'][idx])
+        self._sources = self._sources[:idx] + (source,) + self._sources[idx+1:]
+        return source
+
+    def _settable(self, name):
+        # mirrors the checks made by step 2 of _assign
+        for source in self._sources:
+            if source.has(name) or source.typed(name):
+                return True
+        return bool(self._cascade and self._parent and
+                    self._parent._settable(name))
+
+
+def _hassetup(source):
+    # whether source overrides ConfigSource.setup, and so needs to
+    # see all subsections of the config object when it's created
+    from .configsource import ConfigSource
+    return type(source).setup != ConfigSource.setup
+
+
+def _markdirty(changes):
+    # Mark each modified source and all its parents dirty, and record
+    # exactly which parameters were changed in the root source. The
+    # parent chain of a source is only walked once, no matter how
+    # many parameters were changed in it.
+    roots = {}
+    for config, source, name in changes:
+        if id(source) not in roots:
+            root = source
+            root.dirty = True
+            while root.parent:
+                root = root.parent
+                root.dirty = True
+            if root.changed is None:
+                root.changed = set()
+            roots[id(source)] = root
+        roots[id(source)].changed.add(tuple(config._path() + [name]))
+
+
+class _AbsentSource(object):
+    # Represents a subsection that a source lacks. Since it has no
+    # content, a single placeholder can stand in for every missing
+    # subsection of a particular source, which saves creating a new
+    # empty source object for every missing subsection. If a value is
+    # set on it, LayeredConfig replaces it with a real (empty) source
+    # object of the same class as its parent.
+    __slots__ = ('parent', 'identifier', 'writable', 'dirty', 'changed',
+                 '_absent')
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.identifier = parent.identifier
+        self.writable = parent.writable
+        self.dirty = False
+        self.changed = None
+        self._absent = None
+
+    def has(self, key):
+        return False
+
+    def typed(self, key):
+        return False
+
+    def get(self, key):
+        raise KeyError(key)
+
+    def keys(self):
+        return []
+
+    def subsections(self):
+        return []
+
+    def setup(self, config):
+        pass
+
+
+def _absentsource(source):
+    # returns the shared placeholder for missing subsections of source
+    absent = getattr(source, '_absent', None)
+    if absent is None:
+        absent = source._absent = _AbsentSource(source)
+    return absent
+
+
+class _BackgroundWriter(object):
+    # Saves sources in a background thread for config objects created
+    # with asyncwrite=True. The thread is started when needed and
+    # exits when there is nothing left to save. Before saving, it
+    # waits a short while so that sources enqueued by a burst of
+    # writes are only saved once.
+
+    delay = 0.05
+
+    def __init__(self):
+        self.lock = threading.RLock()  # held while sources are modified or saved
+        self.cond = threading.Condition()
+        self.pending = []
+        self.running = False
+
+    def enqueue(self, sources):
+        with self.cond:
+            for source in sources:
+                if not any(x is source for x in self.pending):
+                    self.pending.append(source)
+            if self.pending and not self.running:
+                self.running = True
+                thread = threading.Thread(target=self.run,
+                                          name="LayeredConfig writer")
+                thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.delay)
+            with self.cond:
+                sources, self.pending = self.pending, []
+                if not sources:
+                    self.running = False
+                    self.cond.notify_all()
+                    return
+            for source in sources:
+                with self.lock:
+                    if not source.dirty:
+                        continue  # already saved
+                    try:
+                        source.save()
+                    except Exception:
+                        logging.exception("Couldn't save source %s" %
+                                          source.identifier)
+                    else:
+                        source.dirty = False
+                        source.changed = None
+
+    def flush(self):
+        with self.cond:
+            while self.running:
+                self.cond.wait()
+
+
+def _newstats(sources):
+    # the counters of each source are kept by its position in the
+    # root config object, since several sources may have the same
+    # identifier (eg. two INIFile sources)
+    return {'resolved': 0,
+            'unresolved': 0,
+            'sources': [{'identifier': source.identifier,
+                         'has': 0,
+                         'get': 0,
+                         'typed': 0,
+                         'typevalue': 0,
+                         'construct': 0.0,
+                         'saves': 0,
+                         'save': 0.0} for source in sources]}
+
+
+def _instrument(source, counters):
+    # Replace the relevant methods of source with wrappers that
+    # update counters. Only instrumented config objects pay for this,
+    # everyone else calls the methods directly.
+    if (isinstance(source, _AbsentSource) or
+            getattr(source, '_stats', None) is not None):
+        return  # placeholder, or already instrumented
+
+    def counting(method, counter):
+        def wrapper(*args, **kwargs):
+            counters[counter] += 1
+            return method(*args, **kwargs)
+        return wrapper
+
+    def timing(method, counter):
+        def wrapper(*args, **kwargs):
+            start = timer()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                counters[counter] += timer() - start
+        return wrapper
+
+    for name in ('has', 'get', 'typed', 'typevalue'):
+        setattr(source, name, counting(getattr(source, name), name))
+    source.subsection = timing(source.subsection, 'construct')
+    source.setup = timing(source.setup, 'construct')
+    source.save = counting(timing(source.save, 'save'), 'saves')
+    source._stats = counters
@@ -1,16 +1,19 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import codecs
+import mmap
 import plistlib
+import struct
 import sys
 
 from six import text_type as str
-from six import binary_type as bytes
 
 from . import DictSource
+from .dictsource import _decode, _Pending
 
 
 class PListFile(DictSource):
-    def __init__(self, plistfilename=None, writable=True, **kwargs):
+    def __init__(self, plistfilename=None, writable=True, lazy=False,
+                 binary=False, **kwargs):
         """Loads and optionally saves configuration files in PList
         format. Since PList has some support for typed values (supports
         numbers, lists, bools, datetimes *but not dates*), data from
@@ -24,6 +27,14 @@ class PListFile(DictSource):
                          that has this PListFile object amongst its
                          sources should be saved in the PList file.
         :type writable: bool
+        :param lazy: If True, and the file is a binary PList, the file
+                     is memory-mapped and nested dicts are only
+                     decoded when their subsection is first
+                     accessed. Other files are loaded normally.
+        :type lazy: bool
+        :param binary: If True, the file is saved as a binary PList
+                       instead of XML. Requires python 3.4 or later.
+        :type binary: bool
         """
         if sys.version_info >= (3,4):
             self.reader = plistlib.load
@@ -32,6 +43,7 @@ class PListFile(DictSource):
             self.reader = plistlib.readPlist
             self.writer = plistlib.writePlist
         super(PListFile, self).__init__(**kwargs)
+        self.encoding = "utf-8"  # I hope this is a sensible default
         if plistfilename == None and 'parent' in kwargs and hasattr(kwargs['parent'], 'plistfilename'):
             plistfilename = kwargs['parent'].plistfilename
         if 'defaults' in kwargs:
@@ -40,48 +52,136 @@ class PListFile(DictSource):
             self.source = {}
         else:
             with open(plistfilename, "rb") as fp:
-                self.source = self.reader(fp)
+                if lazy and fp.read(8) == b"bplist00":
+                    self.source = _BinaryPList(fp).load()
+                else:
+                    fp.seek(0)
+                    self.source = _decode(self.reader(fp), self.encoding)
             self.plistfilename = plistfilename
             self.dirty = False
-        self.encoding = "utf-8"  # I hope this is a sensible default
+        if binary and sys.version_info < (3,4):
+            raise ValueError("Saving binary PLists requires python 3.4")
+        self.binary = binary
         self.writable = writable
-        
+
     def set(self, key, value):
+        value = _decode(value, self.encoding)
         # plist natively supports some types but not all (notably not date)
         if not isinstance(value, (str, bool, int, list, datetime)):
             value = str(value)
         super(PListFile, self).set(key, value)
 
-    def get(self, key):
-        ret = super(PListFile, self).get(key)
-        if isinstance(ret, bytes):
-            ret = ret.decode(self.encoding)
-        # same with individual elements of lists
-        elif isinstance(ret, list):
-            for idx, val in enumerate(ret):
-                if isinstance(ret[idx], bytes):
-                    ret[idx] = ret[idx].decode(self.encoding)
-        return ret
-
     def typed(self, key):
         # if the value is anything other than a string, we can be sure
         # that it contains useful type information.
         return self.has(key) and not isinstance(self.get(key), str)
 
-    def keys(self):
-        for k in super(PListFile, self).keys():
-            if isinstance(k, bytes):
-                k = k.decode(self.encoding)
-            yield k
-
-    def subsections(self):
-        for k in super(PListFile, self).subsections():
-            if isinstance(k, bytes):
-                k = k.decode(self.encoding)
-            yield k
-
     def save(self):
         assert not self.parent, "save() should only be called on root objects"
         if self.plistfilename:
-            with open(self.plistfilename, "wb") as fp:
-                self.writer(self.source, fp)
+            self._loadall()
+            with self._atomicfile(self.plistfilename, "wb") as fp:
+                if self.binary:
+                    self.writer(self.source, fp, fmt=plistlib.FMT_BINARY)
+                else:
+                    self.writer(self.source, fp)
+
+
+class _BinaryPList(object):
+    # Reads a binary PList ("bplist00") file through a memory map.
+    # Unlike plistlib, which decodes the entire file at once, dicts
+    # nested in other dicts are represented by _Pending placeholders,
+    # and only decoded (using the offset table at the end of the file)
+    # when needed. Strings in <data> elements are decoded like
+    # PListFile does for other files.
+
+    epoch = datetime(2001, 1, 1)
+    formats = {1: ">B", 2: ">H", 4: ">I", 8: ">Q"}
+
+    def __init__(self, fp):
+        self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        (self.offsetsize, self.refsize, count, self.top,
+         self.tableoffset) = struct.unpack(">6xBBQQQ", self.data[-32:])
+
+    def load(self):
+        return self.loaddict(self.top)
+
+    def _int(self, pos, size):
+        # reads an unsigned big-endian integer of any size
+        if size in self.formats:
+            return struct.unpack(self.formats[size],
+                                 self.data[pos:pos+size])[0]
+        return int(codecs.encode(self.data[pos:pos+size], "hex") or "0", 16)
+
+    def _offset(self, ref):
+        return self._int(self.tableoffset + ref * self.offsetsize,
+                         self.offsetsize)
+
+    def _refs(self, pos, count):
+        return [self._int(pos + i * self.refsize, self.refsize)
+                for i in range(count)]
+
+    def _size(self, pos):
+        # returns the size of the object at pos, and the position
+        # where its contents start
+        size = ord(self.data[pos:pos+1]) & 0xF
+        if size == 0xF:
+            # the size is stored as an int object
+            intsize = 1 << (ord(self.data[pos+1:pos+2]) & 0xF)
+            return self._int(pos + 2, intsize), pos + 2 + intsize
+        return size, pos + 1
+
+    def loaddict(self, ref):
+        pos = self._offset(ref)
+        if ord(self.data[pos:pos+1]) & 0xF0 != 0xD0:
+            raise ValueError("Object %s is not a dict" % ref)
+        count, pos = self._size(pos)
+        keys = self._refs(pos, count)
+        values = self._refs(pos + count * self.refsize, count)
+        result = {}
+        for (k, v) in zip(keys, values):
+            result[self.loadobject(k)] = self.loadobject(v, lazy=True)
+        return result
+
+    def loadobject(self, ref, lazy=False):
+        pos = self._offset(ref)
+        marker = ord(self.data[pos:pos+1])
+        kind = marker & 0xF0
+        if marker == 0x00:
+            return None
+        elif marker == 0x08:
+            return False
+        elif marker == 0x09:
+            return True
+        elif kind == 0x10:
+            size = 1 << (marker & 0xF)
+            value = self._int(pos + 1, size)
+            if size >= 8 and value >= 1 << (size * 8 - 1):
+                value -= 1 << (size * 8)  # 8 and 16 byte ints are signed
+            return value
+        elif marker == 0x22:
+            return struct.unpack(">f", self.data[pos+1:pos+5])[0]
+        elif marker == 0x23:
+            return struct.unpack(">d", self.data[pos+1:pos+9])[0]
+        elif marker == 0x33:
+            seconds = struct.unpack(">d", self.data[pos+1:pos+9])[0]
+            return self.epoch + timedelta(seconds=seconds)
+        elif kind == 0x40:
+            size, pos = self._size(pos)
+            return _decode(self.data[pos:pos+size], "utf-8")
+        elif kind == 0x50:
+            size, pos = self._size(pos)
+            return self.data[pos:pos+size].decode("ascii")
+        elif kind == 0x60:
+            size, pos = self._size(pos)
+            return self.data[pos:pos+size*2].decode("utf-16be")
+        elif kind == 0xA0:
+            size, pos = self._size(pos)
+            return [self.loadobject(x) for x in self._refs(pos, size)]
+        elif kind == 0xD0:
+            if lazy:
+                return _Pending(self.loaddict, ref)
+            return self.loaddict(ref)
+        else:
+            raise ValueError("Unsupported object type %#x in binary PList" %
+                             marker)
@@ -2,10 +2,21 @@ import six
 from . import ConfigSource
 
 import inspect
+import marshal
+import os
+import struct
+import sys
+import threading
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:  # pragma: no cover
+    # python 2
+    from imp import get_magic
+    MAGIC_NUMBER = get_magic()
 
 class PyFile(ConfigSource):
 
-    def __init__(self, pyfilename=None, **kwargs):
+    def __init__(self, pyfilename=None, cache=False, **kwargs):
         """Loads configuration from a python source file. Any variables
         defined in that file will be interpreted as configuration
         keys. The class ``Subsection`` is automatically imported into
@@ -14,31 +25,104 @@ class PyFile(ConfigSource):
         object is treated as a configuration parameter on that
         subsection.
 
+        The class ``lazy`` is imported as well. A value like
+        ``lazy(lambda: expensive(base))`` is computed the first time
+        the parameter is accessed instead of when the file is loaded,
+        and is then remembered. The function can use anything
+        defined or imported in the file.
+
         .. note::
 
            The python source file is loaded and interpreted once, when
            creating the PyFile object. If a value is set by
            eg. calling a function, that function will only be called
-           at load time, not when accessing the parameter.
+           at load time, not when accessing the parameter, unless it
+           is wrapped in ``lazy``.
 
         :param pyfile: The name of a file containing valid python code.
         :type pyfile: str
+        :param cache: If True, the compiled code is cached in a
+                      ``__pycache__`` directory next to the file, like
+                      python does for imported modules, and reused as
+                      long as the file's modification time and size
+                      are unchanged. This speeds up loading large
+                      files, but creates files next to the
+                      configuration file, so it's off by default. No
+                      cache files are written if
+                      :py:data:`sys.dont_write_bytecode` is set.
+        :type cache: bool
 
         """
         super(PyFile, self).__init__(**kwargs)
         self.source = Subsection()
         if pyfilename:
-            with open(pyfilename) as fp:
-                pycode = compile(fp.read(), pyfilename, 'exec')
-            six.exec_(pycode, globals(), self.source)
+            if cache:
+                pycode = self._cachedcompile(pyfilename)
+            else:
+                pycode = self._compile(pyfilename)
+            # run the file in a single namespace, so that functions
+            # defined in it (eg. for lazy values) can see the other
+            # names in the file
+            namespace = {'Subsection': Subsection,
+                         'lazy': lazy}
+            six.exec_(pycode, namespace)
+            for name, value in (('Subsection', Subsection),
+                                ('lazy', lazy)):
+                if namespace.get(name) is value:
+                    del namespace[name]
+            namespace.pop('__builtins__', None)
+            self.source.update(namespace)
         elif kwargs.get('dict'):
             self.source = kwargs['dict']
         
+    def _compile(self, pyfilename):
+        with open(pyfilename) as fp:
+            return compile(fp.read(), pyfilename, 'exec')
+
+    def _cachedcompile(self, pyfilename):
+        # The cache file starts with the magic number of the python
+        # version, so that files from other versions are ignored, and
+        # the mtime and size of pyfilename when it was compiled,
+        # followed by the marshalled code object.
+        stat = os.stat(pyfilename)
+        header = MAGIC_NUMBER + struct.pack("<dQ", stat.st_mtime,
+                                            stat.st_size)
+        if hasattr(sys, 'implementation'):
+            tag = sys.implementation.cache_tag
+        else:  # pragma: no cover
+            tag = "python%s%s" % sys.version_info[:2]
+        dirname, basename = os.path.split(os.path.abspath(pyfilename))
+        cachefile = os.path.join(dirname, "__pycache__",
+                                 "%s.%s.pyc" % (basename, tag))
+        try:
+            with open(cachefile, "rb") as fp:
+                data = fp.read()
+            if data.startswith(header):
+                return marshal.loads(data[len(header):])
+        except (IOError, OSError, ValueError, EOFError, TypeError):
+            # no cache, or a corrupt one
+            pass
+        pycode = self._compile(pyfilename)
+        if not sys.dont_write_bytecode:
+            try:
+                if not os.path.exists(os.path.dirname(cachefile)):
+                    os.makedirs(os.path.dirname(cachefile))
+                with self._atomicfile(cachefile, "wb") as fp:
+                    fp.write(header + marshal.dumps(pycode))
+            except (IOError, OSError):
+                # eg. a read-only directory. We'll just have to
+                # compile the file the next time as well.
+                pass
+        return pycode
+
     def has(self, key):
         return key in self.source and not isinstance(key, Subsection)
 
     def get(self, key):
-        return self.source.get(key)
+        value = self.source.get(key)
+        if isinstance(value, lazy):
+            value = value()
+        return value
 
     def keys(self):
         for key, val in self.source.items():
@@ -63,6 +147,42 @@ class PyFile(ConfigSource):
         # if we have it, it's typed
         return self.has(key)
 
+class lazy(object):
+    """Wraps a function that computes a configuration value in a PyFile
+    config file. The function is called without arguments the first
+    time the value is accessed, and the result is returned from then
+    on.
+
+    :param function: The function that computes the value.
+    :type function: callable
+    :param threadsafe: If True, a lock makes sure that the function
+                       is only called once even if several threads
+                       access the value at the same time.
+    :type threadsafe: bool
+
+    """
+
+    def __init__(self, function, threadsafe=False):
+        self.function = function
+        self.lock = threading.Lock() if threadsafe else None
+        self.evaluated = False
+        self.value = None
+
+    def __call__(self):
+        if not self.evaluated:
+            if self.lock:
+                with self.lock:
+                    if not self.evaluated:
+                        self._evaluate()
+            else:
+                self._evaluate()
+        return self.value
+
+    def _evaluate(self):
+        self.value = self.function()
+        self.evaluated = True
+
+
 class Subsection(dict):
     # pass
 
@@ -1,28 +1,77 @@
-import codecs
-
 import yaml
+try:
+    # the libyaml based loader and dumper are much faster, but are
+    # only available if pyyaml was built with libyaml
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+    _backend = "libyaml"
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader, SafeDumper
+    _backend = "python"
 
 from . import DictSource
+from .dictsource import _decode
+
+
+def _load(fp):
+    return yaml.load(fp, Loader=SafeLoader)
+
+
+def _merge(target, data):
+    # recursively copies the content of data into target, overwriting
+    # any existing values except nested dicts, which are merged
+    for (k, v) in data.items():
+        if isinstance(v, dict):
+            if not isinstance(target.get(k), dict):
+                target[k] = {}
+            _merge(target[k], v)
+        elif isinstance(v, list):
+            target[k] = list(v)
+        else:
+            target[k] = v
+    return target
+
 
 class YAMLFile(DictSource):
-    def __init__(self, yamlfilename=None, writable=True, **kwargs):
+
+    backend = _backend
+    """Either ``"libyaml"`` if the fast, libyaml based, parser and
+    emitter are used, or ``"python"`` if the pure python
+    implementation is used."""
+
+    def __init__(self, yamlfilename=None, writable=True, includes=False,
+                 **kwargs):
         """Loads and optionally saves configuration files in YAML
         format. Since YAML (and the library implementing the support,
         PyYAML) has automatic support for typed values, data from this
         source are typed.
 
         :param yamlfile: The name of a YAML file. Nested
-                         sections are turned into nested config objects.
+                         sections are turned into nested config
+                         objects. If the file contains several YAML
+                         documents (separated by ``---``), they are
+                         merged, with values in later documents
+                         overriding those in earlier. Changed values
+                         are saved in the last document.
         :type yamlfile: str
         :param writable: Whether changes to the LayeredConfig object
                          that has this YAMLFile object amongst its
                          sources should be saved in the YAML file.
         :type writable: bool
+        :param includes: If True, any mapping with a ``$ref`` key,
+                         like ``{$ref: common/db.yaml}``, is replaced
+                         with the content of that YAML file (relative
+                         to this file). Other keys in the mapping
+                         override keys from the referenced
+                         file. Referenced files are only parsed once
+                         per process, unless they change. Sources
+                         using includes are never writable.
+        :type includes: bool
 
         """
 
 
         super(YAMLFile, self).__init__(**kwargs)
+        self.encoding = "utf-8"  # not sure this is ever really needed
         if yamlfilename == None and 'parent' in kwargs and hasattr(kwargs['parent'], 'yamlfilename'):
             yamlfilename = kwargs['parent'].yamlfilename
         if 'defaults' in kwargs:
@@ -30,30 +79,84 @@ class YAMLFile(DictSource):
         elif kwargs.get('empty', False):
             self.source = {}
         else:
-            with codecs.open(yamlfilename, encoding="utf-8") as fp:
-                # do we need safe_load?
-                self.source = yaml.safe_load(fp.read())
+            # let the parser read (and detect the encoding of) the
+            # file itself
+            with open(yamlfilename, "rb") as fp:
+                # pyyaml by default makes strings whose content fit
+                # in ascii available (on python2) as str objects, not
+                # unicode. Undo this sillyness once and for all.
+                documents = [_decode(doc, self.encoding) for doc in
+                             yaml.load_all(fp, Loader=SafeLoader)]
+            if len(documents) > 1:
+                self.documents = [doc or {} for doc in documents]
+                self.source = {}
+                for doc in self.documents:
+                    _merge(self.source, doc)
+            elif documents:
+                self.source = documents[0]
+            else:
+                self.source = None
+            if includes:
+                self.source = _decode(
+                    self._includerefs(self.source, yamlfilename, _load),
+                    self.encoding)
+                # saving would replace the references with their content
+                writable = False
             self.yamlfilename = yamlfilename
             self.dirty = False
         self.writable = writable
-        self.encoding = "utf-8"  # not sure this is ever really needed
 
-    def get(self, key):
-        ret = super(YAMLFile, self).get(key)
-        # pyyaml by default makes strings whose content fit in ascii
-        # available (on python2) as str objects, not unicode. Undo
-        # this sillyness.
-        if isinstance(ret, bytes):
-            ret = ret.decode(self.encoding)
-        # same with individual elements of lists
-        elif isinstance(ret, list):
-            for idx, val in enumerate(ret):
-                if isinstance(ret[idx], bytes):
-                    ret[idx] = ret[idx].decode(self.encoding)
-        return ret
+    def set(self, key, value):
+        super(YAMLFile, self).set(key, _decode(value, self.encoding))
 
     def save(self):
         assert not self.parent, "save() should only be called on root objects"
         if self.yamlfilename:
-            with codecs.open(self.yamlfilename, "w", encoding=self.encoding) as fp:
-                yaml.safe_dump(self.source, fp, default_flow_style=False)
+            if hasattr(self, 'documents'):
+                self._updatelast()
+                data = self.documents
+            else:
+                data = [self.source]
+            with self._atomicfile(self.yamlfilename, encoding=self.encoding) as fp:
+                yaml.dump_all(data, fp, Dumper=SafeDumper,
+                              default_flow_style=False)
+
+    def _updatelast(self):
+        # copy all changed values to the last of several documents
+        last = self.documents[-1]
+        if self.changed is None:
+            # we don't know what's changed, so make the last document
+            # contain everything that differs from the others
+            base = {}
+            for doc in self.documents[:-1]:
+                _merge(base, doc)
+            changed = _diff(self.source, base)
+        else:
+            changed = self.changed
+        for path in changed:
+            value = self.source
+            try:
+                for key in path:
+                    value = value[key]
+            except (KeyError, TypeError):
+                # the value was set on an object that isn't part of
+                # this source, eg. for a missing subsection
+                continue
+            target = last
+            for key in path[:-1]:
+                if not isinstance(target.get(key), dict):
+                    target[key] = {}
+                target = target[key]
+            target[path[-1]] = value
+
+
+def _diff(data, base, path=()):
+    # returns the paths (tuples of keys) of all values in data that
+    # doesn't exist, or has another value, in base
+    paths = []
+    for (k, v) in data.items():
+        if isinstance(v, dict) and isinstance(base.get(k), dict):
+            paths.extend(_diff(v, base[k], path + (k,)))
+        elif k not in base or base[k] != v:
+            paths.append(path + (k,))
+    return paths
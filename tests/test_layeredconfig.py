@@ -10,10 +10,13 @@ Tests for `layeredconfig` module.
 
 
 import os
+import shutil
+import threading
 import logging
 import sys
 import codecs
 from six import text_type as str
+from six.moves import configparser
 from datetime import date, datetime
 import argparse
 import json
@@ -383,6 +386,19 @@ class TestINIFile(TestINIFileHelper, unittest.TestCase,
         for key in self.simple.keys():
             self.assertFalse(self.simple.typed(key))
 
+    def test_subsection_index(self):
+        mymodule = self.complex.subsection("mymodule")
+        arbitrary = mymodule.subsection("arbitrary")
+        self.assertIs(self.complex.index, arbitrary.index)
+        self.assertEqual(["nesting"], arbitrary.subsections())
+        self.assertEqual([], arbitrary.subsection("nesting").subsections())
+
+        # setting a value in a nonexistent section creates it
+        newsection = mymodule.subsection("newsection")
+        newsection.set("key", "value")
+        self.assertEqual("value", newsection.get("key"))
+        self.assertEqual(["arbitrary", "newsection"], mymodule.subsections())
+
     def test_inifile_default_as_root(self):
         # using a rootsection named DEFAULT triggers different
         # cascading-like behaviour in configparser.
@@ -469,6 +485,146 @@ unique = True
             got = fp.read().replace("\r\n", "\n")
         self.assertEqual(want, got)
 
+    def test_write_incremental(self):
+        with open("incremental.ini", "w") as fp:
+            fp.write("""# settings for mydata
+[__root__]
+home = mydata
+; number of workers
+processes = 4
+
+[mymodule]
+extra = foo,
+    bar
+expires = 2014-10-15
+""")
+        try:
+            src = INIFile("incremental.ini", incremental=True)
+            cfg = LayeredConfig(src)
+            cfg.processes = 8
+            cfg.mymodule.extra = ['foo', 'baz', 'quux']
+            cfg.mymodule.force = False
+            LayeredConfig.write(cfg)
+            # new sections are appended at the end
+            src.subsection("newmodule").set("depth", 3)
+            src.changed = set([("newmodule", "depth")])
+            src.save()
+            want = """# settings for mydata
+[__root__]
+home = mydata
+; number of workers
+processes = 8
+
+[mymodule]
+extra = foo, baz, quux
+expires = 2014-10-15
+force = False
+
+[newmodule]
+depth = 3
+"""
+            with open("incremental.ini") as fp:
+                got = fp.read().replace("\r\n", "\n")
+            self.assertEqual(want, got)
+        finally:
+            os.unlink("incremental.ini")
+
+    def test_directory(self):
+        os.mkdir("conf.d")
+        try:
+            with open("conf.d/10-base.ini", "w") as fp:
+                fp.write("[__root__]\nhome = mydata\nprocesses = 4\n"
+                         "[mymodule]\nforce = False\n")
+            with open("conf.d/20-host.ini", "w") as fp:
+                fp.write("[__root__]\nprocesses = 8\n"
+                         "[extramodule]\nunique = True\n")
+            with open("conf.d/README", "w") as fp:
+                fp.write("not an ini file")
+            for path in ("conf.d", "conf.d/*.ini"):
+                src = INIFile(path)
+                self.assertFalse(src.writable)
+                cfg = LayeredConfig(src)
+                self.assertEqual("mydata", cfg.home)
+                self.assertEqual("8", cfg.processes)
+                self.assertEqual("False", cfg.mymodule.force)
+                self.assertEqual("True", cfg.extramodule.unique)
+        finally:
+            for f in os.listdir("conf.d"):
+                os.unlink("conf.d/" + f)
+            os.rmdir("conf.d")
+
+    def test_glob_characters_in_filename(self):
+        shutil.copy2("simple.ini", "conf[1].ini")
+        try:
+            src = INIFile("conf[1].ini")
+            self.assertTrue(src.writable)
+            cfg = LayeredConfig(src)
+            self.assertEqual("mydata", cfg.home)
+        finally:
+            os.unlink("conf[1].ini")
+
+
+class TestINIFileMmap(TestINIFile):
+
+    def setUp(self):
+        super(TestINIFileMmap, self).setUp()
+        self.simple = INIFile("simple.ini", engine="mmap")
+        self.complex = INIFile("complex.ini", engine="mmap")
+        self.extra = INIFile("extra.ini", engine="mmap")
+        self.extra_layered = INIFile("extra-layered.ini", engine="mmap")
+
+    def test_write(self):
+        # files read with the mmap engine can't be saved
+        self.assertFalse(self.complex.writable)
+
+    def test_write_incremental(self):
+        self.assertFalse(INIFile("complex.ini", engine="mmap",
+                                 incremental=True).writable)
+
+    def test_multiline(self):
+        with open("multiline.ini", "w") as fp:
+            fp.write("""
+[DEFAULT]
+loglevel = INFO
+
+[__root__]
+home = mydata
+extra = foo,
+   bar
+   # a comment
+   baz
+processes: 4
+""")
+        try:
+            want = INIFile("multiline.ini")
+            got = INIFile("multiline.ini", engine="mmap")
+            self.assertEqual(list(want.keys()), list(got.keys()))
+            for key in want.keys():
+                self.assertEqual(want.get(key), got.get(key))
+        finally:
+            os.unlink("multiline.ini")
+
+    def test_lazy_sections(self):
+        # sections are only parsed when first accessed
+        parser = self.complex.source
+        self.assertEqual({}, parser._sections)
+        self.assertEqual(['__root__', 'mymodule',
+                          'mymodule.arbitrary.nesting', 'extramodule'],
+                         parser.sections())
+        self.assertEqual({}, parser._sections)
+        self.assertEqual('2014-10-15', parser.get('mymodule', 'expires'))
+        self.assertEqual(['mymodule'], [x for x in parser._sections
+                                        if x != 'DEFAULT'])
+
+    def test_missing_header(self):
+        with open("noheader.ini", "w") as fp:
+            fp.write("# comment\nhome = mydata\n[__root__]\nfoo = bar\n")
+        try:
+            with self.assertRaises(configparser.MissingSectionHeaderError):
+                INIFile("noheader.ini", engine="mmap")
+        finally:
+            os.unlink("noheader.ini")
+
 
 class TestJSONFile(unittest.TestCase, ConfigSourceHelperTests):
 
@@ -574,6 +730,104 @@ class TestJSONFile(unittest.TestCase, ConfigSourceHelperTests):
             got = fp.read().replace("\r\n", "\n")
         self.assertEqual(want, got)
 
+    def test_set_typed(self):
+        cfg = LayeredConfig(self.simple)
+        cfg.processes = 8
+        cfg.extra = ['foo', 'baz']
+        cfg.lastrun = datetime(2014, 10, 24, 9, 15, 0)
+        # assigned values keep their types in memory...
+        self.assertEqual(8, self.simple.get("processes"))
+        self.assertTrue(self.simple.typed("processes"))
+        self.assertEqual(['foo', 'baz'], cfg.extra)
+        self.assertEqual(datetime(2014, 10, 24, 9, 15, 0), cfg.lastrun)
+        # ...and when saved
+        LayeredConfig.write(cfg)
+        with open("simple.json") as fp:
+            got = json.load(fp)
+        self.assertEqual(8, got["processes"])
+        self.assertEqual(['foo', 'baz'], got["extra"])
+        self.assertEqual("2014-10-24 09:15:00", got["lastrun"])
+
+    def test_backend(self):
+        self.assertEqual("json",
+                         JSONFile("simple.json", backend="json").backend)
+        with self.assertRaises(ValueError):
+            JSONFile("simple.json", backend="nosuchjson")
+        os.environ["LAYEREDCONFIG_JSON_BACKEND"] = "auto"
+        try:
+            src = JSONFile("simple.json")
+        finally:
+            del os.environ["LAYEREDCONFIG_JSON_BACKEND"]
+        self.assertIn(src.backend, ("orjson", "ujson", "json"))
+        # whatever backend is used, saved files are read back the same
+        cfg = LayeredConfig(src)
+        cfg.expires = date(2014, 10, 24)
+        cfg.lastrun = datetime(2014, 10, 24, 9, 15, 0)
+        LayeredConfig.write(cfg)
+        got = JSONFile("simple.json", backend="json")
+        self.assertEqual("2014-10-24", got.get("expires"))
+        self.assertEqual("2014-10-24 09:15:00", got.get("lastrun"))
+        self.assertEqual(['foo', 'bar'], got.get("extra"))
+
+    def test_lazy(self):
+        src = JSONFile("complex.json", lazy=True)
+        # nested objects aren't decoded until needed
+        self.assertEqual({}, src.source["mymodule"])
+        self.assertEqual(4, src.get("processes"))
+        cfg = LayeredConfig(src)
+        self.assertEqual({}, src.source["extramodule"])
+        self.assertEqual("works", cfg.mymodule.arbitrary.nesting.depth)
+        self.assertEqual(LayeredConfig.dump(LayeredConfig(self.complex)),
+                         LayeredConfig.dump(cfg))
+        # undecoded objects are decoded when saving
+        cfg = LayeredConfig(JSONFile("complex.json", lazy=True))
+        cfg.home = "otherdata"
+        LayeredConfig.write(cfg)
+        with open("complex.json") as fp:
+            got = json.load(fp)
+        self.assertEqual({"unique": True}, got["extramodule"])
+        self.assertEqual("otherdata", got["home"])
+
+    def test_includes(self):
+        os.mkdir("common")
+        with open("common/db.json", "w") as fp:
+            fp.write('{"host": "localhost", "port": 5432, '
+                     '"options": {"$ref": "options.json"}}')
+        with open("common/options.json", "w") as fp:
+            fp.write('{"timeout": 30}')
+        with open("includes.json", "w") as fp:
+            fp.write('{"home": "mydata", '
+                     '"db": {"$ref": "common/db.json"}, '
+                     '"otherdb": {"$ref": "common/db.json", "port": 5433}}')
+        try:
+            src = JSONFile("includes.json", includes=True)
+            self.assertFalse(src.writable)
+            cfg = LayeredConfig(src)
+            self.assertEqual("localhost", cfg.db.host)
+            self.assertEqual(5432, cfg.db.port)
+            self.assertEqual(30, cfg.db.options.timeout)
+            self.assertEqual("localhost", cfg.otherdb.host)
+            self.assertEqual(5433, cfg.otherdb.port)
+            # each reference gets its own copy of the referenced data
+            cfg.db.host = "dbserver"
+            self.assertEqual("localhost", cfg.otherdb.host)
+            self.assertEqual("localhost",
+                             LayeredConfig(JSONFile("includes.json",
+                                                    includes=True)).db.host)
+            # without includes, the references are just data
+            cfg = LayeredConfig(JSONFile("includes.json"))
+            self.assertEqual("common/db.json", getattr(cfg.db, "$ref"))
+
+            with open("common/options.json", "w") as fp:
+                fp.write('{"$ref": "db.json"}')
+            with self.assertRaises(ValueError):
+                JSONFile("includes.json", includes=True)
+        finally:
+            os.unlink("includes.json")
+            os.unlink("common/db.json")
+            os.unlink("common/options.json")
+            os.rmdir("common")
+
 class TestYAMLFile(unittest.TestCase,
                    ConfigSourceHelperTests):
     def setUp(self):
@@ -673,6 +927,82 @@ processes: 4
             got = fp.read().replace("\r\n", "\n")
         self.assertEqual(want, got)
 
+    def test_includes(self):
+        with open("db.yaml", "w") as fp:
+            fp.write("host: localhost\nport: 5432\n")
+        with open("includes.yaml", "w") as fp:
+            fp.write("home: mydata\n"
+                     "db:\n"
+                     "    $ref: db.yaml\n"
+                     "    port: 5433\n")
+        try:
+            cfg = LayeredConfig(YAMLFile("includes.yaml", includes=True))
+            self.assertEqual("mydata", cfg.home)
+            self.assertEqual("localhost", cfg.db.host)
+            self.assertEqual(5433, cfg.db.port)
+        finally:
+            os.unlink("includes.yaml")
+            os.unlink("db.yaml")
+
+    def test_multiple_documents(self):
+        with open("layers.yaml", "w") as fp:
+            fp.write("""home: mydata
+processes: 4
+mymodule:
+    force: false
+    expires: 2014-10-15
+---
+processes: 8
+mymodule:
+    force: true
+""")
+        try:
+            cfg = LayeredConfig(YAMLFile("layers.yaml"))
+            self.assertEqual("mydata", cfg.home)
+            self.assertEqual(8, cfg.processes)
+            self.assertEqual(True, cfg.mymodule.force)
+            self.assertEqual(date(2014, 10, 15), cfg.mymodule.expires)
+            cfg.mymodule.expires = date(2014, 10, 24)
+            LayeredConfig.write(cfg)
+            want = """home: mydata
+mymodule:
+  expires: 2014-10-15
+  force: false
+processes: 4
+---
+mymodule:
+  expires: 2014-10-24
+  force: true
+processes: 8
+"""
+            with open("layers.yaml") as fp:
+                got = fp.read().replace("\r\n", "\n")
+            self.assertEqual(want, got)
+        finally:
+            os.unlink("layers.yaml")
+
+    def test_multiple_documents_missing_subsection(self):
+        with open("layers.yaml", "w") as fp:
+            fp.write("home: mydata\n---\nprocesses: 8\n")
+        try:
+            cfg = LayeredConfig(Defaults({'mymodule': {'force': False}}),
+                                YAMLFile("layers.yaml"))
+            cfg.mymodule.force = True
+            cfg.processes = 16
+            LayeredConfig.write(cfg)
+            with open("layers.yaml") as fp:
+                got = fp.read().replace("\r\n", "\n")
+            self.assertEqual("home: mydata\n---\nprocesses: 16\n", got)
+        finally:
+            os.unlink("layers.yaml")
+
+    def test_backend(self):
+        import yaml
+        if yaml.__with_libyaml__:
+            self.assertEqual("libyaml", self.simple.backend)
+        else:
+            self.assertEqual("python", self.simple.backend)
+
 
 class TestPListFile(unittest.TestCase, ConfigSourceHelperTests):
 
@@ -859,6 +1189,55 @@ class TestPListFile(unittest.TestCase, ConfigSourceHelperTests):
             else:
                 self.assertFalse(self.simple.typed(key))
 
+    def test_data_decoded(self):
+        with open("data.plist", "w") as fp:
+            fp.write("""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+	<key>mymodule</key>
+	<dict>
+		<key>home</key>
+		<data>bXlkYXRh</data>
+		<key>extra</key>
+		<array>
+			<data>Zm9v</data>
+			<string>bar</string>
+		</array>
+	</dict>
+</dict>
+</plist>
+""")
+        try:
+            src = PListFile("data.plist")
+            # <data> elements are decoded to strings once, when loading
+            self.assertEqual({'mymodule': {'home': 'mydata',
+                                           'extra': ['foo', 'bar']}},
+                             src.source)
+            cfg = LayeredConfig(src)
+            self.assertEqual("mydata", cfg.mymodule.home)
+            self.assertEqual(['foo', 'bar'], cfg.mymodule.extra)
+        finally:
+            os.unlink("data.plist")
+
+    @unittest.skipIf(sys.version_info < (3, 4),
+                     "Binary PLists require python 3.4")
+    def test_binary(self):
+        # save complex.plist in binary format...
+        cfg = LayeredConfig(PListFile("complex.plist", binary=True))
+        cfg.home = "otherdata"
+        LayeredConfig.write(cfg)
+        with open("complex.plist", "rb") as fp:
+            self.assertEqual(b"bplist00", fp.read(8))
+        want = LayeredConfig.dump(LayeredConfig(PListFile("complex.plist")))
+        self.assertEqual("otherdata", want['home'])
+        # ...and read it lazily
+        src = PListFile("complex.plist", lazy=True)
+        self.assertEqual({}, src.source["mymodule"])
+        cfg = LayeredConfig(src)
+        self.assertEqual("works", cfg.mymodule.arbitrary.nesting.depth)
+        self.assertEqual(want, LayeredConfig.dump(cfg))
+
 
 class TestPyFile(unittest.TestCase, ConfigSourceHelperTests):
 
@@ -918,6 +1297,82 @@ mymodule.force = True
         os.unlink("extra.py")
         os.unlink("extra-layered.py")
 
+    def test_cache(self):
+        dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+        os.mkdir("cached")
+        cachefile = None
+        try:
+            with open("cached/conf.py", "w") as fp:
+                fp.write("home = 'mydata'\n")
+            # nothing is cached unless asked for
+            self.assertEqual("mydata", PyFile("cached/conf.py").get("home"))
+            self.assertFalse(os.path.exists("cached/__pycache__"))
+            self.assertEqual("mydata",
+                             PyFile("cached/conf.py", cache=True).get("home"))
+            cachefiles = os.listdir("cached/__pycache__")
+            self.assertEqual(1, len(cachefiles))
+            cachefile = "cached/__pycache__/" + cachefiles[0]
+            self.assertTrue(cachefile.startswith("cached/__pycache__/conf.py."))
+
+            # the cached code is used as long as the file is unchanged...
+            class CachedPyFile(PyFile):
+                def _compile(self, pyfilename):
+                    raise AssertionError("%s was compiled" % pyfilename)
+            self.assertEqual("mydata",
+                             CachedPyFile("cached/conf.py",
+                                          cache=True).get("home"))
+            # ...but not when it's changed
+            with open("cached/conf.py", "w") as fp:
+                fp.write("home = 'otherdata'\n")
+            self.assertEqual("otherdata",
+                             PyFile("cached/conf.py", cache=True).get("home"))
+        finally:
+            sys.dont_write_bytecode = dont_write_bytecode
+            if cachefile:
+                os.unlink(cachefile)
+                os.rmdir("cached/__pycache__")
+            os.unlink("cached/conf.py")
+            os.rmdir("cached")
+
+    def test_lazy(self):
+        with open("lazy.py", "w") as fp:
+            fp.write("""home = 'mydata'
+secret = lazy(lambda: open("secret.txt").read())
+mymodule = Subsection()
+mymodule.secret = lazy(lambda: open("secret.txt").read(), threadsafe=True)
+""")
+        try:
+            # secret.txt doesn't exist yet, but isn't read until needed
+            cfg = LayeredConfig(PyFile("lazy.py", cache=False))
+            self.assertEqual(['home', 'secret'], sorted(cfg))
+            with open("secret.txt", "w") as fp:
+                fp.write("s3cr3t")
+            self.assertEqual("s3cr3t", cfg.secret)
+            self.assertEqual("s3cr3t", cfg.mymodule.secret)
+            # the values are memoized
+            os.unlink("secret.txt")
+            self.assertEqual("s3cr3t", cfg.secret)
+            self.assertEqual("s3cr3t", cfg.mymodule.secret)
+        finally:
+            os.unlink("lazy.py")
+
+    def test_lazy_namespace(self):
+        with open("lazy.py", "w") as fp:
+            fp.write("""import datetime
+base = 10
+derived = lazy(lambda: base * 2)
+mymodule = Subsection()
+mymodule.expires = lazy(lambda: datetime.date(2014, 10, base + 5))
+""")
+        try:
+            cfg = LayeredConfig(PyFile("lazy.py", cache=False))
+            self.assertEqual(['base', 'derived'], sorted(cfg))
+            self.assertEqual(20, cfg.derived)
+            self.assertEqual(date(2014, 10, 15), cfg.mymodule.expires)
+        finally:
+            os.unlink("lazy.py")
+
 
 class TestCommandline(unittest.TestCase, ConfigSourceHelperTests):
 
@@ -1013,6 +1468,70 @@ class TestCommandline(unittest.TestCase, ConfigSourceHelperTests):
         self.assertIsInstance(cfg.log.rotation_size, str)
         self.assertEquals(cfg.log.rotation_size, '100')
 
+    def test_parse_once(self):
+        class CountingParser(argparse.ArgumentParser):
+            parses = 0
+
+            def parse_known_args(self, *args, **kwargs):
+                self.parses += 1
+                return super(CountingParser, self).parse_known_args(
+                    *args, **kwargs)
+
+        parser = CountingParser()
+        parser.add_argument('--home')
+        src = Commandline(self.complex_cmdline, parser=parser)
+        self.assertEqual(1, parser.parses)
+        cfg = LayeredConfig(Defaults({'home': 'default',
+                                      'mymodule': {'force': True}}), src)
+        # every key is already present on the command line, so
+        # nothing needs to be parsed again
+        self.assertEqual(1, parser.parses)
+        self.assertEqual("mydata", cfg.home)
+        self.assertIs(False, cfg.mymodule.force)
+
+    def test_setup_subsection(self):
+        src = Commandline(['--home=mydata', '--mymodule-extra=foo'],
+                          parser=argparse.ArgumentParser())
+        cfg = LayeredConfig(Defaults({'mymodule': {'force': True}}), src)
+        options = src.parser._option_string_actions
+        self.assertIn('--mymodule-force', options)
+        self.assertNotIn('--force', options)
+        self.assertIs(True, cfg.mymodule.force)
+
+    def test_typed_subsection(self):
+        src = Commandline(['--mymodule-force=False', '--mymodule-expires=5'],
+                          parser=argparse.ArgumentParser())
+        cfg = LayeredConfig(Defaults({'mymodule': {'force': True,
+                                                   'expires': 1}}), src)
+        # the auto-added options aren't typed by the parser, so the
+        # values are converted using the types from Defaults
+        self.assertFalse(src.subsection('mymodule').typed('force'))
+        self.assertIs(False, cfg.mymodule.force)
+        self.assertEqual(5, cfg.mymodule.expires)
+
+    def test_without_argparse(self):
+        cmdline = ['--home', 'mydata', '--force', '-v', '--extra=foo',
+                   '--extra', '-1', '--mymodule-force', 'False',
+                   'file.txt']
+        src = Commandline(cmdline)
+        self.assertIsNone(src.parser)
+        self.assertEqual(['-v', 'file.txt'], src.rest)
+        cfg = LayeredConfig(src)
+        self.assertEqual("mydata", cfg.home)
+        self.assertIs(True, cfg.force)
+        self.assertEqual(['foo', '-1'], cfg.extra)
+        self.assertEqual("False", cfg.mymodule.force)
+
+        # "--" needs argparse, and gives the same result otherwise
+        src = Commandline(cmdline + ['--', 'other.txt'])
+        self.assertIsNotNone(src.parser)
+        self.assertEqual(['-v', 'file.txt', '--', 'other.txt'], src.rest)
+        cfg = LayeredConfig(src)
+        self.assertEqual("mydata", cfg.home)
+        self.assertIs(True, cfg.force)
+        self.assertEqual(['foo', '-1'], cfg.extra)
+        self.assertEqual("False", cfg.mymodule.force)
+
 
 class TestCommandlineConfigured(TestCommandline):
 
@@ -1101,6 +1620,41 @@ class TestEnvironment(unittest.TestCase, ConfigSourceHelperTests):
         for key in self.simple.keys():
             self.assertFalse(self.simple.typed(key))
 
+    def test_refresh(self):
+        env = {'MYAPP_HOME': 'mydata',
+               'MYAPP_MYMODULE_FORCE': 'False',
+               'MYAPP_OTHER_MYMODULE_FORCE': 'True',
+               'OTHERAPP_HOME': 'otherdata'}
+        src = Environment(env, prefix="MYAPP_")
+        sub = src.subsection("mymodule")
+        self.assertIs(src.index, sub.index)
+        self.assertEqual(["force"], list(sub.keys()))
+        self.assertEqual("False", sub.get("force"))
+        # new variables aren't noticed...
+        env['MYAPP_MYMODULE_EXTRA'] = 'foo, bar'
+        self.assertFalse(sub.has("extra"))
+        # ...until refresh is called
+        src.refresh()
+        self.assertTrue(sub.has("extra"))
+        self.assertEqual("foo, bar", sub.get("extra"))
+
+    def test_nested(self):
+        env = {'MYAPP_MYMODULE': 'value',
+               'MYAPP_MYMODULE_FORCE': 'False',
+               'MYAPP_MYMODULE_ARBITRARY_NESTING_DEPTH': 'works',
+               'MYAPP_EXTRAMODULE_MYMODULE_FORCE': 'True'}
+        src = Environment(env, prefix="MYAPP_")
+        self.assertEqual(["mymodule"], list(src.keys()))
+        self.assertEqual(["extramodule", "mymodule"],
+                         sorted(src.subsections()))
+        sub = src.subsection("mymodule")
+        self.assertEqual(["force"], list(sub.keys()))
+        self.assertEqual(["arbitrary"], list(sub.subsections()))
+        nested = sub.subsection("arbitrary").subsection("nesting")
+        self.assertEqual("works", nested.get("depth"))
+        nested.set("width", "wide")
+        self.assertEqual("wide", env["MYAPP_MYMODULE_ARBITRARY_NESTING_WIDTH"])
+
 
 # NB: This assumes that an etcd daemon is running with default
 # settings
@@ -1516,6 +2070,39 @@ class TestSubsections(unittest.TestCase):
             cfg.subsection.subsection
 
 
+    def test_absent_subsections(self):
+        defaults = {'home': 'mydata',
+                    'mymodule': {'processes': int},
+                    'extramodule': {'force': bool}}
+        iniobj = INIFile()
+        cfg = LayeredConfig(Defaults(defaults), iniobj)
+        # neither subsection exists in the INIFile object, so they
+        # share the same placeholder
+        self.assertIs(cfg.mymodule._sources[1], cfg.extramodule._sources[1])
+        self.assertEqual([], list(cfg.mymodule))
+
+        # setting a value replaces the placeholder with a real source
+        cfg.mymodule.processes = 4
+        self.assertEqual(4, cfg.mymodule.processes)
+        self.assertIsInstance(cfg.mymodule._sources[1], INIFile)
+        self.assertIsNot(cfg.mymodule._sources[1], cfg.extramodule._sources[1])
+        with self.assertRaises(AttributeError):
+            cfg.extramodule.processes
+
+    def test_lazy_subsections(self):
+        defaults = {'mymodule': {'processes': 4},
+                    'extramodule': {'force': True}}
+        cfg = LayeredConfig(Defaults(defaults))
+        # subsections are only created when first accessed...
+        self.assertEqual([None, None], list(cfg._subsections.values()))
+        self.assertEqual(4, cfg.mymodule.processes)
+        self.assertIs(cfg.mymodule, cfg.mymodule)
+        self.assertIsNone(cfg._subsections['extramodule'])
+        # ...unless a source needs to see all of them in its setup
+        cfg = LayeredConfig(Defaults(defaults), Commandline([]))
+        self.assertNotIn(None, list(cfg._subsections.values()))
+
+
 class TestLayeredSubsections(unittest.TestCase):
 
     def _test_subsection(self, primary, secondary, cls):
@@ -1656,6 +2243,128 @@ class TestModifications(TestINIFileHelper, unittest.TestCase):
         cfg.lastrun = datetime(2013, 9, 18, 15, 41, 0)
         LayeredConfig.write(cfg)
 
+    def test_write_changed_only(self):
+        cfg = LayeredConfig(Defaults({'processes': int}),
+                            INIFile("complex.ini"),
+                            instrument=True)
+        cfg.processes = 8
+        cfg.mymodule.force = True
+        inifile = cfg._sources[1]
+        self.assertTrue(inifile.dirty)
+        self.assertEqual(set([('processes',), ('mymodule', 'force')]),
+                         inifile.changed)
+        LayeredConfig.write(cfg)
+        self.assertFalse(inifile.dirty)
+        self.assertIsNone(inifile.changed)
+        # nothing has changed since the last write, so nothing should
+        # be saved
+        LayeredConfig.write(cfg)
+        stats = LayeredConfig.stats(cfg)
+        self.assertEqual(1, stats['sources'][1]['saves'])
+
+    def test_transaction(self):
+        cfg = LayeredConfig(Defaults({'processes': int}),
+                            INIFile("complex.ini"),
+                            instrument=True)
+        with LayeredConfig.transaction(cfg):
+            cfg.processes = 8
+            cfg.mymodule.force = True
+            cfg.mymodule.extra = ['foo', 'quux']
+            # not applied until the transaction is committed
+            self.assertEqual(4, cfg.processes)
+        self.assertEqual(8, cfg.processes)
+        self.assertEqual("True", cfg.mymodule.force)
+        stats = LayeredConfig.stats(cfg)
+        self.assertEqual(1, stats['sources'][1]['saves'])
+        self.assertEqual(8, LayeredConfig(Defaults({'processes': int}),
+                                          INIFile("complex.ini")).processes)
+
+    def test_transaction_rollback(self):
+        cfg = LayeredConfig(INIFile("complex.ini"))
+        with self.assertRaises(ValueError):
+            with LayeredConfig.transaction(cfg):
+                cfg.home = "otherdata"
+                raise ValueError("something went wrong")
+        self.assertEqual("mydata", cfg.home)
+        self.assertFalse(cfg._sources[0].dirty)
+
+        # assigning a nonexistent key fails immediately, and also
+        # rolls back the transaction
+        with self.assertRaises(AttributeError):
+            with LayeredConfig.transaction(cfg):
+                cfg.home = "otherdata"
+                cfg.nonexistent = "value"
+        self.assertEqual("mydata", cfg.home)
+
+    def test_transaction_threads(self):
+        cfg = LayeredConfig(INIFile("complex.ini"))
+
+        def assign():
+            cfg.processes = "8"
+        with self.assertRaises(ValueError):
+            with LayeredConfig.transaction(cfg):
+                cfg.home = "otherdata"
+                # an assignment from another thread isn't part of
+                # this transaction, and isn't rolled back with it
+                thread = threading.Thread(target=assign)
+                thread.start()
+                thread.join()
+                self.assertEqual("8", cfg.processes)
+                raise ValueError("something went wrong")
+        self.assertEqual("mydata", cfg.home)
+        self.assertEqual("8", cfg.processes)
+
+    def test_asyncwrite(self):
+        cfg = LayeredConfig(Defaults({'processes': int}),
+                            INIFile("complex.ini"),
+                            instrument=True,
+                            asyncwrite=True)
+        # hold the writer's lock, so that no save can happen before
+        # all writes are done, however slow they are
+        with cfg._writer.lock:
+            for i in range(5, 10):
+                cfg.processes = i
+                LayeredConfig.write(cfg)
+        LayeredConfig.flush(cfg)
+        # all five writes should have been coalesced into a single save
+        stats = LayeredConfig.stats(cfg)
+        self.assertEqual(1, stats['sources'][1]['saves'])
+        self.assertFalse(cfg._sources[1].dirty)
+        self.assertEqual(9, LayeredConfig(Defaults({'processes': int}),
+                                          INIFile("complex.ini")).processes)
+        self.assertEqual(["complex.ini"],
+                         [x for x in os.listdir(".") if x.startswith("complex.ini")])
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), "needs symlinks")
+    def test_write_symlink(self):
+        os.symlink("complex.ini", "link.ini")
+        try:
+            cfg = LayeredConfig(Defaults({'processes': int}),
+                                INIFile("link.ini"))
+            cfg.processes = 42
+            LayeredConfig.write(cfg)
+            # the link is kept, and the file it points to is changed
+            self.assertTrue(os.path.islink("link.ini"))
+            self.assertEqual(42, LayeredConfig(Defaults({'processes': int}),
+                                               INIFile("complex.ini")).processes)
+        finally:
+            os.unlink("link.ini")
+
+    def test_asyncwrite_set(self):
+        # LayeredConfig.set waits for a save in progress
+        cfg = LayeredConfig(Defaults({'processes': int}),
+                            INIFile("complex.ini"),
+                            asyncwrite=True)
+        with cfg._writer.lock:
+            thread = threading.Thread(target=LayeredConfig.set,
+                                      args=(cfg, 'home', 'otherdata', 'inifile'))
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual("mydata", cfg.home)
+        thread.join()
+        self.assertEqual("otherdata", cfg.home)
+
     def test_set_novalue(self):
         # it should be possible to set values that are defined in any
         # of the configsources, even though only typing information
@@ -1698,6 +2407,92 @@ class TestAccessors(TestINIFileHelper, unittest.TestCase):
         self.assertEqual("NO!", LayeredConfig.get(cfg, "nonexistent", "NO!"))
 
 
+class TestStats(TestINIFileHelper, unittest.TestCase):
+
+    def test_stats(self):
+        cfg = LayeredConfig(Defaults({'processes': int,
+                                      'mymodule': {}}),
+                            INIFile("complex.ini"),
+                            instrument=True)
+        self.assertEqual(4, cfg.processes)
+        self.assertEqual("False", cfg.mymodule.force)
+        with self.assertRaises(AttributeError):
+            cfg.nonexistent
+        stats = LayeredConfig.stats(cfg.mymodule)
+        self.assertEqual(2, stats['resolved'])
+        self.assertEqual(1, stats['unresolved'])
+        self.assertEqual(['defaults', 'inifile'],
+                         [x['identifier'] for x in stats['sources']])
+        self.assertTrue(stats['sources'][1]['has'])
+        self.assertTrue(stats['sources'][1]['get'])
+        self.assertEqual(1, stats['sources'][0]['typevalue'])
+        self.assertGreater(stats['sources'][1]['construct'], 0)
+
+        cfg.home = "otherdata"
+        LayeredConfig.write(cfg)
+        stats = LayeredConfig.stats(cfg)
+        self.assertEqual(1, stats['sources'][1]['saves'])
+        self.assertGreater(stats['sources'][1]['save'], 0)
+
+        LayeredConfig.resetstats(cfg)
+        stats = LayeredConfig.stats(cfg)
+        self.assertEqual(0, stats['resolved'])
+        self.assertEqual(0, stats['sources'][1]['has'])
+        self.assertEqual(0, stats['sources'][1]['saves'])
+
+    def test_stats_same_identifier(self):
+        # sources with the same identifier are counted separately
+        cfg = LayeredConfig(INIFile("simple.ini"),
+                            INIFile("complex.ini"),
+                            instrument=True)
+        self.assertEqual("False", cfg.mymodule.force)
+        stats = LayeredConfig.stats(cfg)
+        self.assertEqual(['inifile', 'inifile'],
+                         [x['identifier'] for x in stats['sources']])
+        # simple.ini has no [mymodule] section
+        self.assertEqual(0, stats['sources'][0]['has'])
+        self.assertTrue(stats['sources'][1]['has'])
+
+    def test_not_instrumented(self):
+        cfg = LayeredConfig(INIFile("simple.ini"))
+        self.assertIsNone(LayeredConfig.stats(cfg))
+        LayeredConfig.resetstats(cfg)
+
+
+class TestTracer(unittest.TestCase):
+
+    def tearDown(self):
+        LayeredConfig.set_tracer(None)
+
+    def test_tracer(self):
+        calls = []
+
+        def tracer(path, sourceid, typesourceid, elapsed):
+            calls.append((path, sourceid, typesourceid))
+            self.assertGreaterEqual(elapsed, 0)
+
+        cfg = LayeredConfig(Defaults({'processes': int,
+                                      'force': False,
+                                      'mymodule': {'home': 'mydata'}}),
+                            Environment({'MYAPP_PROCESSES': '4'},
+                                        prefix="MYAPP_"))
+        LayeredConfig.set_tracer(tracer)
+        self.assertEqual(4, cfg.processes)
+        self.assertEqual(False, cfg.force)
+        self.assertEqual('mydata', cfg.mymodule.home)
+        with self.assertRaises(AttributeError):
+            cfg.mymodule.nonexistent
+        self.assertEqual([('processes', 'environment', 'defaults'),
+                          ('force', 'defaults', 'defaults'),
+                          ('mymodule.home', 'defaults', 'defaults'),
+                          ('mymodule.nonexistent', None, None)],
+                         calls)
+
+        LayeredConfig.set_tracer(None)
+        self.assertEqual(4, cfg.processes)
+        self.assertEqual(4, len(calls))
+
+
 class TestDump(unittest.TestCase):
     def test_dump(self):
         defaults = {